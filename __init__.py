@@ -4,3 +4,7 @@ from page import Page
 from webnote import Webnote
 from metadata import Metadata
 from directory import Directory
+from metaindex import MetadataIndex
+from jobs import JobQueue
+from manifest import Manifest
+from pictureorder import PictureOrder
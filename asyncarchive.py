@@ -0,0 +1,143 @@
+"""webnote.asyncarchive. Pages for servers built around an event loop.
+
+Building a webnote.page.Page does blocking filesystem work, listing
+directories and reading files, and rendering its content is CPU
+work. Either will stall an event loop. The AsyncArchive class does
+both in thread pools, and hands back futures.
+
+This uses concurrent.futures, which under Python 2 is provided by the
+futures package.
+
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import multiprocessing
+import threading
+
+from page import Page
+import settings
+
+
+class AsyncArchive():
+    """Build and render pages off the calling thread.
+
+    ### Usage
+
+        archive = AsyncArchive(docroot, baseurl)
+        future = archive.page(address)
+
+    page() returns a concurrent.futures.Future, which resolves to a
+    Page with its content already rendered. An asyncio front end
+    awaits it with:
+
+        page = await asyncio.wrap_future(archive.page(address))
+
+    The Page is constructed in a bounded pool of io_workers threads,
+    then its content is rendered by the render executor. Concurrent
+    requests for the same address, made while one is in progress,
+    share the one future, and so the one Page. Treat it as read-only.
+
+    """
+
+    docroot = None
+    baseurl = None
+    staticroot = None
+
+    def __init__(self, docroot, baseurl, staticroot=None,
+                 io_workers=None, render_workers=None):
+        """Start the thread pools.
+
+        io_workers defaults to settings.ASYNC_IO_WORKERS. The render
+        pool has render_workers threads, defaulting to
+        settings.RENDER_WORKERS, or one for each CPU.
+
+        """
+
+        if not io_workers:
+            io_workers = settings.ASYNC_IO_WORKERS
+
+        if not render_workers:
+            render_workers = settings.RENDER_WORKERS
+        if not render_workers:
+            render_workers = multiprocessing.cpu_count()
+
+        self.docroot = docroot
+        self.baseurl = baseurl
+        self.staticroot = staticroot
+
+        self.io_executor = ThreadPoolExecutor(io_workers)
+        self.render_executor = ThreadPoolExecutor(render_workers)
+
+        # Futures for addresses in progress, keyed by address. Hold
+        # the lock to read or write it.
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _build(self, address):
+        return Page(self.docroot, self.baseurl, address,
+                    staticroot=self.staticroot)
+
+    def _built(self, key, future, build):
+        """Hand a freshly built Page to the render executor."""
+
+        try:
+            page = build.result()
+            render = self.render_executor.submit(page.content)
+        except Exception as e:
+            self._finish(key, future, exception=e)
+            return
+
+        render.add_done_callback(
+            lambda f: self._rendered(key, future, page, f))
+
+    def _finish(self, key, future, page=None, exception=None):
+        """Resolve the future, and stop offering it to new requests."""
+
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(page)
+
+    def _rendered(self, key, future, page, render):
+
+        try:
+            render.result()
+        except Exception as e:
+            self._finish(key, future, exception=e)
+            return
+
+        self._finish(key, future, page)
+
+    def page(self, address=None):
+        """Return a future resolving to the rendered Page at address.
+
+        Exceptions raised while building or rendering the page, such
+        as Page.DocrootNotFound, are raised by the future's result().
+
+        """
+
+        key = address or ''
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._pending[key] = future
+
+        build = self.io_executor.submit(self._build, address)
+        build.add_done_callback(lambda f: self._built(key, future, f))
+
+        return future
+
+    def shutdown(self, wait=True):
+        """Stop the thread pools, once the work in hand is done."""
+
+        self.io_executor.shutdown(wait)
+        self.render_executor.shutdown(wait)
@@ -0,0 +1,269 @@
+"""Generate synthetic webnote archives for benchmarking.
+
+The archive is laid out like manual/: an index page at the top, page
+files with metafiles in a meta/ directory beside them, and a paired
+directory for each page holding its children and its figures. A
+gallery page at the top has a paired directory of pictures.
+
+    python benchmarks/archive.py <docroot> [--depth 3] [--fanout 4]
+        [--page-size 4000] [--figures 2] [--pictures 8] [--no-metafiles]
+
+The same arguments always make the same archive.
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+from PIL import Image
+
+
+WORDS = (
+    'archive', 'page', 'figure', 'caption', 'directory', 'metadata',
+    'webnote', 'simple', 'syntax', 'gallery', 'picture', 'thumbnail',
+    'the', 'a', 'of', 'and', 'in', 'to', 'is', 'with', 'for', 'on',
+    'survey', 'field', 'notes', 'river', 'track', 'station', 'report',
+)
+
+METAFILE = """# Dublin core metadata.
+DC.title: %(title)s
+DC.creator: %(creator)s
+DC.subject: %(subject)s
+DC.description: A generated page for benchmarking.
+DC.contributor:
+DC.coverage:
+DC.date: %(date)s
+DC.type: %(doctype)s
+DC.format: text/markup
+DC.source:
+DC.language: en
+DC.relation:
+DC.identifier:
+DC.publisher:
+DC.rights:
+# end Dublin core elements.
+
+# Page commands.
+status: %(status)s
+sort:
+deny:
+allow:
+embargo:
+# End page commands.
+"""
+
+GALLERY = 'Gallery'
+
+#   A hidden file at the top of a generated archive, recording the
+#   parameters it was made with.
+MARKER = '.benchmark-archive'
+
+
+class Archive():
+    """The shape of a synthetic archive, and the means to make it.
+
+    ### Usage
+
+        archive = Archive(depth=3, fanout=4)
+        archive.make(docroot)
+        archive.addresses      # every page address, top down.
+
+    depth is the number of levels of pages below the index, fanout
+    the number of pages in each directory, page_size the approximate
+    size of each page file in bytes, figures the number of figures in
+    each paired directory, and pictures the number of pictures in the
+    gallery. With metafiles off, pages have no metafiles.
+
+    """
+
+    depth = None
+    fanout = None
+    page_size = None
+    figures = None
+    pictures = None
+    metafiles = None
+
+    def __init__(self, depth=3, fanout=4, page_size=4000, figures=2,
+                 pictures=8, metafiles=True, seed=0):
+
+        self.depth = depth
+        self.fanout = fanout
+        self.page_size = page_size
+        self.figures = figures
+        self.pictures = pictures
+        self.metafiles = metafiles
+        self.seed = seed
+
+        self.addresses = []
+        self._random = None
+
+    def _figures(self, dirpath):
+        """Write the figures for a page, return their filenames."""
+
+        fnames = []
+        for n in range(self.figures):
+            fname = 'figure_%02d.png' % n
+            _image(os.path.join(dirpath, fname), (64, 48), self._random)
+            fnames.append(fname)
+
+        return fnames
+
+    def _metafile(self, dirpath, basename, title, n):
+
+        metadir = os.path.join(dirpath, 'meta')
+        if not os.path.isdir(metadir):
+            os.mkdir(metadir)
+
+        values = {
+            'title': title,
+            'creator': ('A. Writer', 'B. Editor')[n % 2],
+            'subject': ', '.join(self._random.sample(WORDS, 3)),
+            'date': '20%02d-%02d-%02d' % (
+                10 + n % 10, 1 + n % 12, 1 + n % 28),
+            'doctype': ('Text', 'Manual', 'Report')[n % 3],
+            'status': ('draft', 'final')[n % 2],
+        }
+
+        with open(os.path.join(metadir, basename + '.meta'), 'w') as f:
+            f.write(METAFILE % values)
+
+    def _page(self, dirpath, basename, title, figures, n):
+        """Write a page file, with a metafile, referring to figures."""
+
+        with open(os.path.join(dirpath, basename + '.md'), 'w') as f:
+            f.write(self._text(title, figures))
+
+        if self.metafiles:
+            self._metafile(dirpath, basename, title, n)
+
+    def _pages(self, dirpath, address, level):
+        """Write a directory of pages, and the levels below it."""
+
+        for n in range(self.fanout):
+            basename = '%03d_Section_%d_%d' % (n * 10, level, n)
+            paired = os.path.join(dirpath, basename)
+            os.mkdir(paired)
+
+            page_address = address + '/' + basename if address else basename
+            self.addresses.append(page_address)
+
+            figures = self._figures(paired)
+            self._page(dirpath, basename, basename.replace('_', ' '),
+                       figures, n + level)
+
+            if level < self.depth:
+                self._pages(paired, page_address, level + 1)
+
+    def _text(self, title, figures):
+        """Return markdown of about page_size bytes, with headings."""
+
+        lines = [title, '=' * len(title), '']
+        size = 0
+        section = 0
+
+        while size < self.page_size:
+            if size >= section * 1000:
+                section += 1
+                heading = 'Part %d' % section
+                lines += [heading, '-' * len(heading), '']
+                if section <= len(figures):
+                    lines += ['[[%s Figure %d.]]' % (
+                        figures[section - 1], section), '']
+
+            words = [self._random.choice(WORDS) for i in range(60)]
+            paragraph = ' '.join(words).capitalize() + '.'
+            lines += [paragraph, '']
+            size += len(paragraph) + 1
+
+        return '\n'.join(lines)
+
+    def make(self, docroot):
+        """Write the archive into docroot, which must not exist yet."""
+
+        self._random = random.Random(self.seed)
+        self.addresses = []
+
+        os.makedirs(docroot)
+
+        self._page(docroot, 'index', 'Synthetic archive', [], 0)
+
+        gallery = os.path.join(docroot, GALLERY)
+        os.mkdir(gallery)
+        self._page(docroot, GALLERY, 'Gallery', [], 0)
+        for n in range(self.pictures):
+            _image(os.path.join(gallery, 'IMG_%04d.jpg' % n), (800, 600),
+                   self._random)
+
+        self._pages(docroot, '', 1)
+
+        with open(os.path.join(docroot, MARKER), 'w') as f:
+            json.dump(self.parameters(), f, sort_keys=True)
+
+        return docroot
+
+    def parameters(self):
+        """Return the shape of the archive as a dictionary."""
+
+        return {
+            'depth': self.depth,
+            'fanout': self.fanout,
+            'page_size': self.page_size,
+            'figures': self.figures,
+            'pictures': self.pictures,
+            'metafiles': self.metafiles,
+            'seed': self.seed,
+        }
+
+
+def _image(filename, size, rand):
+    """Write a small image, a flat colour, in the format of its suffix."""
+
+    colour = tuple(rand.randint(0, 255) for i in range(3))
+    Image.new('RGB', size, colour).save(filename)
+
+
+def add_arguments(parser):
+    """Add the archive shape options to an argparse parser."""
+
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--page-size', type=int, default=4000)
+    parser.add_argument('--figures', type=int, default=2)
+    parser.add_argument('--pictures', type=int, default=8)
+    parser.add_argument('--no-metafiles', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def from_arguments(args):
+    """Return the Archive described by parsed add_arguments() options."""
+
+    return Archive(
+        depth=args.depth, fanout=args.fanout, page_size=args.page_size,
+        figures=args.figures, pictures=args.pictures,
+        metafiles=not args.no_metafiles, seed=args.seed)
+
+
+def read_parameters(docroot):
+    """Return the parameters a generated archive was made with."""
+
+    with open(os.path.join(docroot, MARKER)) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('docroot')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    archive = from_arguments(args)
+    archive.make(args.docroot)
+    print len(archive.addresses), 'pages written to', args.docroot
+
+
+if __name__ == '__main__':
+    sys.exit(main())
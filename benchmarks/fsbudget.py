@@ -0,0 +1,150 @@
+"""Hold webnote operations to budgets of filesystem calls.
+
+    python benchmarks/fsbudget.py [--update]
+
+Each operation is run once to warm the caches, as a server would have
+them, then run again while its filesystem calls are counted with
+webnote.fscount. The counts are checked against the budgets in
+fsbudget.json, and the script exits with status 1 if any operation
+went over. Over budget, the paths of the calls are listed, so the
+redundant walk can be found.
+
+The operations use manual/, which is part of the repository, so the
+counts are the same on every machine. The one exception is where
+scandir is available, in Python 3 or from the scandir package. Its
+listings count as listdirs, but they save the stat of each entry, so
+there may be fewer stats, and never more. Budgets are set without
+scandir. When a change makes an operation cheaper, run with --update
+to lower its budget to the new counts, and lock the improvement in.
+
+"""
+
+import argparse
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import fscount
+from gallery import Gallery
+from metaindex import MetadataIndex
+from page import Page
+
+
+DOCROOT = os.path.join(ROOT, 'manual')
+BASEURL = '/manual'
+BUDGETS = os.path.join(HERE, 'fsbudget.json')
+
+#   The kinds of call held to a budget.
+KINDS = ('listdir', 'lstat', 'open', 'stat')
+
+
+def _page_init():
+    Page(DOCROOT, BASEURL, 'Examples/blog/entry1')
+
+
+def _content():
+    Page(DOCROOT, BASEURL, 'Examples/blog/entry1').content()
+
+
+def _children():
+    Page(DOCROOT, BASEURL, 'Examples/blog').children()
+
+
+def _sibling_links():
+    Page(DOCROOT, BASEURL, 'Examples/blog/entry1').sibling_links()
+
+
+def _breadcrumbs():
+    Page(DOCROOT, BASEURL, 'Examples/blog/depth_test/level1').breadcrumbs()
+
+
+def _gallery_pictures():
+    Gallery(DOCROOT, BASEURL, 'Examples/blog').pictures()
+
+
+def _index_refresh():
+    index = MetadataIndex(DOCROOT, indexfile=':memory:')
+    try:
+        index.refresh()
+        index.query(creator='M.G.Hutchinson')
+    finally:
+        index.close()
+
+
+OPERATIONS = (
+    ('page_init', _page_init),
+    ('content', _content),
+    ('children', _children),
+    ('sibling_links', _sibling_links),
+    ('breadcrumbs', _breadcrumbs),
+    ('gallery_pictures', _gallery_pictures),
+    ('index_refresh', _index_refresh),
+)
+
+
+def count(operation):
+    """Return the FilesystemCalls of an operation, run warm."""
+
+    operation()
+    with fscount.counting() as calls:
+        operation()
+
+    return calls
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--update', action='store_true',
+                        help='Set the budgets to the counts now.')
+    args = parser.parse_args(argv)
+
+    budgets = {}
+    if os.path.isfile(BUDGETS):
+        with open(BUDGETS) as f:
+            budgets = json.load(f)
+
+    counts = {}
+    failed = False
+
+    print '%-18s %s' % ('operation', '  '.join('%14s' % k for k in KINDS))
+
+    for (name, operation) in OPERATIONS:
+        calls = count(operation)
+        counts[name] = dict((kind, calls[kind]) for kind in KINDS)
+        budget = budgets.get(name, {})
+
+        print '%-18s %s' % (name, '  '.join(
+            '%5d of %5s' % (calls[kind], budget.get(kind, '-'))
+            for kind in KINDS))
+
+        try:
+            calls.assert_at_most(**dict(
+                (str(kind), limit) for (kind, limit) in budget.items()))
+        except fscount.FilesystemCalls.BudgetExceeded as e:
+            failed = True
+            for (kind, (n, limit, paths)) in sorted(e.value.items()):
+                print '    %s over budget, %d of %d:' % (kind, n, limit)
+                for path in paths:
+                    print '       ', path
+
+    if args.update:
+        with open(BUDGETS, 'w') as f:
+            json.dump(counts, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+        print 'Budgets updated.'
+        return 0
+
+    if failed:
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
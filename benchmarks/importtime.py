@@ -0,0 +1,190 @@
+"""Hold the import time of webnote's modules to a budget.
+
+    python benchmarks/importtime.py [--repeat N] [--update]
+
+Each module is imported in a fresh interpreter, so nothing is already
+loaded, and the time taken and the heavy dependencies it loaded are
+recorded. The renderers, image and GPS libraries are only loaded by
+the code which uses them, so a process which only reads metadata, or
+a worker which only indexes, doesn't pay for them.
+
+The times and loads are checked against importbudget.json, and the
+script exits with status 1 if any module went over. A module may load
+only the heavy dependencies its budget allows. When a change makes an
+import cheaper, run with --update to set the budgets to the new
+figures, with some headroom for the times, which vary from
+machine to machine.
+
+Under Python 3.7 and later, the interpreter's own -X importtime
+report is used for the time. Python 2 has no such report, so the
+import is timed in the fresh interpreter instead.
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+BUDGETS = os.path.join(HERE, 'importbudget.json')
+
+#   The modules whose import is measured.
+MODULES = (
+    'cli',
+    'directory',
+    'gallery',
+    'hashstore',
+    'jobs',
+    'metadata',
+    'metaindex',
+    'page',
+    'watcher',
+)
+
+#   The dependencies which are expensive to load.
+HEAVY = (
+    'PIL',
+    'bs4',
+    'exifread',
+    'gpxpy',
+    'html2text',
+    'markdown2',
+    'pytz',
+    'smartypants',
+)
+
+#   Budgets are set, by --update, to this multiple of the time measured
+#   plus this many milliseconds, so that a busy machine doesn't fail.
+HEADROOM = 1.5
+SLACK = 10
+
+#   Run in the fresh interpreter. Prints the time in seconds and the
+#   heavy modules loaded, as JSON.
+PROBE = """
+import json, sys, time
+sys.path.insert(0, %(root)r)
+start = time.time()
+import %(module)s
+seconds = time.time() - start
+heavy = sorted(name for name in %(heavy)r if name in sys.modules)
+sys.stdout.write(json.dumps({'seconds': seconds, 'heavy': heavy}))
+"""
+
+
+def _importtime_supported():
+    return sys.version_info >= (3, 7)
+
+
+def _importtime_seconds(stderr, module):
+    """Return the cumulative time of module from an -X importtime report.
+
+    Lines are 'import time: self | cumulative | name', in microseconds.
+
+    """
+
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000000.0
+
+    return None
+
+
+def measure(module):
+    """Import module in a fresh interpreter.
+
+    Return a dictionary of the seconds taken and the heavy modules
+    loaded.
+
+    """
+
+    probe = PROBE % {'root': ROOT, 'module': module, 'heavy': HEAVY}
+    command = [sys.executable]
+    if _importtime_supported():
+        command += ['-X', 'importtime']
+    command += ['-c', probe]
+
+    process = subprocess.Popen(
+        command, cwd=ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    (stdout, stderr) = process.communicate()
+
+    if process.returncode:
+        raise RuntimeError('importing %s failed:\n%s' % (module, stderr))
+
+    result = json.loads(stdout)
+
+    if _importtime_supported():
+        seconds = _importtime_seconds(stderr, module)
+        if seconds is not None:
+            result['seconds'] = seconds
+
+    return result
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Imports of each module, the best kept.')
+    parser.add_argument('--update', action='store_true',
+                        help='Set the budgets to the figures now.')
+    args = parser.parse_args(argv)
+
+    budgets = {}
+    if os.path.isfile(BUDGETS):
+        with open(BUDGETS) as f:
+            budgets = json.load(f)
+
+    figures = {}
+    failed = False
+
+    print('%-12s %9s %9s  %s' % ('module', 'ms', 'budget', 'heavy'))
+
+    for module in MODULES:
+        results = [measure(module) for n in range(args.repeat)]
+        ms = min(result['seconds'] for result in results) * 1000
+        heavy = sorted(set().union(*[result['heavy'] for result in results]))
+        budget = budgets.get(module, {})
+
+        figures[module] = {
+            'max_ms': round(ms * HEADROOM + SLACK, 1),
+            'heavy': heavy,
+        }
+
+        print('%-12s %9.1f %9s  %s' % (
+            module, ms, budget.get('max_ms', '-'), ', '.join(heavy) or '-'))
+
+        if 'max_ms' in budget and ms > budget['max_ms']:
+            failed = True
+            print('    over budget, %.1f ms of %.1f' % (ms, budget['max_ms']))
+
+        if 'heavy' in budget:
+            extra = sorted(set(heavy) - set(budget['heavy']))
+            if extra:
+                failed = True
+                print('    loads %s' % ', '.join(extra))
+
+    if args.update:
+        with open(BUDGETS, 'w') as f:
+            json.dump(figures, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+        print('Budgets updated.')
+        return 0
+
+    if failed:
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""Measure the memory held by the Directory and Metadata of an archive.
+
+    python benchmarks/memory.py [--docroot DIR] [--output results.json]
+        [archive options, as for benchmarks/archive.py]
+
+A server caching an archive holds a Directory for each directory and
+a Metadata for each page. This builds them all, for every directory
+and page in the archive, keeps them, and reports the memory they
+take, in total and for each one.
+
+The default archive has some 56,000 pages, six levels of six, without
+figures or pictures, so that it is quick to generate. As with
+benchmarks/run.py, it is generated in a temporary directory unless
+--docroot names one, and kept there if it does.
+
+Memory is measured with tracemalloc where the interpreter has it.
+Python 2 has not, so there the growth of the peak resident set size
+of the process is used instead. That includes the allocator's own
+overhead, and is only as fine as the operating system reports it,
+but over tens of thousands of objects it shows the difference a
+change makes.
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import archive
+from directory import Directory
+from metadata import Metadata
+import settings
+
+
+class Meter():
+    """Measure the memory allocated since the meter was started.
+
+    Uses tracemalloc if it can be imported, and the peak resident set
+    size of the process otherwise. method names the one in use.
+
+    """
+
+    method = None
+
+    def __init__(self):
+
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+
+        self.tracemalloc = tracemalloc
+
+        if tracemalloc:
+            self.method = 'tracemalloc'
+            tracemalloc.start()
+        else:
+            self.method = 'maxrss'
+
+        self.start = self._used()
+
+    def _used(self):
+
+        if self.tracemalloc:
+            return self.tracemalloc.get_traced_memory()[0]
+
+        # Imported here, as only the fallback needs it.
+        import resource
+
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Linux reports kilobytes, macOS bytes.
+        if sys.platform == 'darwin':
+            return maxrss
+        return maxrss * 1024
+
+    def used(self):
+        """Return the bytes allocated since the meter was started."""
+
+        return self._used() - self.start
+
+    def stop(self):
+
+        if self.tracemalloc:
+            self.tracemalloc.stop()
+
+
+def load_directories(docroot):
+    """Return a Directory for each directory of the archive.
+
+    Hidden directories and meta directories are left out, as a page
+    never lists them.
+
+    """
+
+    directories = []
+    metadir = settings.META[0].strip('/')
+    pending = [docroot]
+
+    while pending:
+        dirpath = pending.pop()
+        directory = Directory(dirpath, docroot=docroot)
+        directories.append(directory)
+
+        for name in directory.model['dirs']:
+            if name != metadir:
+                pending.append(os.path.join(dirpath, name))
+
+    return directories
+
+
+def load_metadata(directories):
+    """Return the Metadata of every page file in directories."""
+
+    metadata = []
+
+    for directory in directories:
+        for fname in directory.model['page']:
+            metadata.append(Metadata(
+                os.path.join(directory.dirpath, fname), directory=directory))
+
+    return metadata
+
+
+def measure(docroot):
+    """Return the memory taken by the archive's Directory and Metadata.
+
+    Return a dictionary of the counts of each, and the bytes they take.
+
+    """
+
+    meter = Meter()
+
+    try:
+        directories = load_directories(docroot)
+        directory_bytes = meter.used()
+
+        metadata = load_metadata(directories)
+        total_bytes = meter.used()
+    finally:
+        meter.stop()
+
+    metadata_bytes = total_bytes - directory_bytes
+
+    return {
+        'method': meter.method,
+        'directories': len(directories),
+        'pages': len(metadata),
+        'directory_bytes': directory_bytes,
+        'metadata_bytes': metadata_bytes,
+        'bytes_per_directory': directory_bytes // max(len(directories), 1),
+        'bytes_per_page': metadata_bytes // max(len(metadata), 1),
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--docroot',
+                        help='Archive to use, generated if missing.')
+    parser.add_argument('--output', help='Write the results as JSON.')
+    archive.add_arguments(parser)
+    parser.set_defaults(depth=6, fanout=6, figures=0, pictures=0,
+                        page_size=200)
+    args = parser.parse_args(argv)
+
+    shape = archive.from_arguments(args)
+
+    temporary = None
+    if args.docroot:
+        docroot = args.docroot
+        if not os.path.isdir(docroot):
+            shape.make(docroot)
+    else:
+        temporary = tempfile.mkdtemp(prefix='webnote-memory-')
+        docroot = shape.make(os.path.join(temporary, 'archive'))
+
+    try:
+        results = measure(docroot)
+    finally:
+        if temporary:
+            shutil.rmtree(temporary, True)
+
+    print '%(directories)d directories, %(pages)d pages, by %(method)s' % (
+        results)
+    print '    Directory %10d bytes, %6d each' % (
+        results['directory_bytes'], results['bytes_per_directory'])
+    print '    Metadata  %10d bytes, %6d each' % (
+        results['metadata_bytes'], results['bytes_per_page'])
+
+    if args.output:
+        results['meta'] = {
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'archive': shape.parameters(),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""Check that paging through a listing or a gallery gives the right pages.
+
+    python benchmarks/paging.py [--files 300] [--limit 7]
+
+A directory of pictures and other files is generated in a temporary
+directory. Its pictures are paged through with Directory.names(),
+called as Gallery.pictures() calls it, by offset and by cursor, in
+both orders, and each page is compared with a slice of the sorted
+names. A directory listed without sort is checked the same way.
+
+A gallery of small pictures, most with an EXIF date, is generated
+too, and paged through with Gallery.pictures() in name and date
+order. The filesystem calls of a page are counted with
+webnote.fscount: they must grow with the page, not the gallery. Then
+the last picture of a page is removed, and the page after it is
+asked for, by the cursor of the picture and by its bare name.
+
+Whatever fails is listed, and the script exits with status 1.
+
+"""
+
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fscount
+from directory import Directory
+from gallery import Gallery
+from pictureorder import PictureOrder
+
+
+#   The stats a page of pictures may make, beyond one for each picture
+#   on it: the gallery directory, and the picture order verifying it.
+STAT_SLACK = 4
+
+
+def make_directory(dirpath, files):
+    """Fill dirpath with files pictures, and some other files."""
+
+    for n in range(files):
+        for name in ('p%04d.jpg' % n, 'n%04d.md' % n):
+            open(os.path.join(dirpath, name), 'w').close()
+    os.mkdir(os.path.join(dirpath, 'q0000.jpg'))
+
+    return sorted('p%04d.jpg' % n for n in range(files))
+
+
+def make_gallery(dirpath, files):
+    """Fill dirpath with files pictures, one in seven without a date.
+
+    Return the names of the pictures in order of date, then name.
+
+    """
+
+    # Imported here, as only the gallery needs it.
+    from PIL import Image
+
+    taken = {}
+    for n in range(files):
+        name = 'p%04d.jpg' % n
+        exif = ''
+        if n % 7 != 3:
+            taken[name] = '2020:01:%02d 10:00:00' % (1 + n * 13 % 28)
+            exif = ('Exif\0\0MM\0*' +
+                    struct.pack('>IHHHII', 8, 1, 0x132, 2, 20, 26) +
+                    struct.pack('>I', 0) + taken[name] + '\0')
+        Image.new('RGB', (4, 4)).save(
+            os.path.join(dirpath, name), 'jpeg', exif=exif)
+
+    dated = sorted(taken, key=lambda name: (taken[name], name))
+    undated = sorted(
+        'p%04d.jpg' % n for n in range(files) if 'p%04d.jpg' % n not in taken)
+
+    return dated + undated
+
+
+def check_names(directory, expected, limit):
+    """Page through the pictures of directory. Return the failures."""
+
+    failures = []
+
+    for reverse in (False, True):
+        ordered = sorted(expected, reverse=reverse)
+
+        for offset in range(0, len(ordered) + limit, limit):
+            page = directory.names(
+                'pictures', offset, limit, None, reverse=reverse)
+            if page != ordered[offset:offset + limit]:
+                failures.append(('offset', 'reverse=%s at %d' % (
+                    reverse, offset)))
+
+        # A cursor which fails to move on would page for ever, so
+        # there are no more pages than names.
+        pages = []
+        after = None
+        for n in range(len(ordered) + 1):
+            page = directory.names(
+                'pictures', 0, limit, after, reverse=reverse)
+            if not page:
+                break
+            pages += page
+            after = page[-1]
+        if pages != ordered:
+            failures.append(('cursor', 'reverse=%s' % reverse))
+
+    if directory.names('pictures') != directory.model['pictures']:
+        failures.append(('whole', 'not the listing'))
+
+    return failures
+
+
+def check_gallery(docroot, address, expected, limit):
+    """Page through a gallery, in both orders. Return the failures.
+
+    The gallery is left with the last picture of the first page by
+    date removed.
+
+    """
+
+    failures = []
+    orders = (('name', sorted(expected)), ('exif_date', expected))
+
+    for (order, ordered) in orders:
+        gallery = Gallery(docroot, '', address)
+
+        pages = []
+        after = None
+        for n in range(len(ordered) + 1):
+            page = gallery.pictures(limit=limit, order=order, after=after)
+            if not page:
+                break
+            pages += [picture.fname for picture in page]
+            after = gallery.cursor(page[-1], order)
+        if pages != ordered:
+            failures.append((order, 'cursor', 'pages out of order'))
+
+        page = gallery.pictures(offset=limit, limit=limit, order=order)
+        if [picture.fname for picture in page] != ordered[limit:2 * limit]:
+            failures.append((order, 'offset', 'wrong second page'))
+
+        with fscount.counting() as calls:
+            gallery.pictures(limit=limit, order=order)
+        if calls['listdir'] or calls['open'] > limit or \
+                calls['stat'] > limit + STAT_SLACK:
+            failures.append((order, 'calls', '%r for %d pictures' % (
+                calls, limit)))
+
+    gallery = Gallery(docroot, '', address)
+    page = gallery.pictures(limit=limit, order='exif_date')
+    cursor = gallery.cursor(page[-1], 'exif_date')
+    os.remove(page[-1].filename)
+
+    gallery = Gallery(docroot, '', address)
+    names = [picture.fname for picture in gallery.pictures(
+        limit=limit, order='exif_date', after=cursor)]
+    if names != expected[limit:2 * limit]:
+        failures.append(('exif_date', 'removed', 'cursor lost its place'))
+
+    try:
+        gallery.pictures(
+            limit=limit, order='exif_date', after=page[-1].fname)
+    except PictureOrder.CursorNotFound:
+        pass
+    else:
+        failures.append(('exif_date', 'removed', 'bare name was placed'))
+
+    return failures
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=300,
+                        help='Pictures in the directory and the gallery.')
+    parser.add_argument('--limit', type=int, default=7,
+                        help='Pictures on a page.')
+    args = parser.parse_args(argv)
+
+    temporary = tempfile.mkdtemp(prefix='webnote-paging-')
+    failures = []
+
+    try:
+        listing = os.path.join(temporary, 'listing')
+        os.mkdir(listing)
+        expected = make_directory(listing, args.files)
+
+        for sort in (True, False):
+            directory = Directory(listing, sort=sort)
+            for failure in check_names(directory, expected, args.limit):
+                failures.append(('names, sort=%s' % sort, ) + failure)
+
+        docroot = os.path.join(temporary, 'archive')
+        os.makedirs(os.path.join(docroot, 'gallery'))
+        expected = make_gallery(os.path.join(docroot, 'gallery'), args.files)
+
+        for failure in check_gallery(
+                docroot, 'gallery', expected, args.limit):
+            failures.append(('gallery, order=%s' % failure[0], ) +
+                            failure[1:])
+    finally:
+        shutil.rmtree(temporary, True)
+
+    print '%d pictures, pages of %d, %d failures' % (
+        args.files, args.limit, len(failures))
+
+    for failure in failures:
+        print '    %s: %s, %s' % failure
+
+    if failures:
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
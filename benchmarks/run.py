@@ -0,0 +1,351 @@
+"""Time the main webnote operations against a synthetic archive.
+
+    python benchmarks/run.py [--repeat 5] [--only NAME ...]
+        [--docroot DIR] [--output results.json]
+        [--compare baseline.json] [--threshold 1.2]
+        [archive options, as for benchmarks/archive.py]
+
+An archive is generated in a temporary directory, unless --docroot
+names one. If that directory does not exist it is generated there and
+kept, so later runs can reuse it. Any other archive, manual/ say, can
+be named too, though the gallery benchmarks, which write thumbnails,
+only run on generated archives.
+
+Each benchmark is run --repeat times, and the minimum, median, mean
+and maximum times are reported. With --output, the results are also
+written as JSON, along with the archive parameters, the Python
+version and the git commit, so a release can be compared with the
+last. --compare reads such a file, reports the change in each median,
+and exits with status 1 if any benchmark got slower by more than
+--threshold times.
+
+Caches held by the webnote modules, such as Directory meta listings,
+are left warm between repeats, as they would be in a server.
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import archive
+from gallery import Gallery
+from page import Page
+import settings
+
+
+#   (name, function) pairs. Each function takes a Context, does any
+#   setup, and returns the callable to be timed.
+BENCHMARKS = []
+
+
+def benchmark(function):
+    """Register a benchmark function, under its name."""
+
+    BENCHMARKS.append((function.__name__, function))
+    return function
+
+
+class Context():
+    """The archive under test, and the pages the benchmarks use.
+
+    leaf is a page at the deepest level, and middle a page half way
+    down, preferring one with both siblings and children. synthetic
+    is True for an archive made by benchmarks/archive.py. Benchmarks
+    which change the archive only run on those.
+
+    """
+
+    docroot = None
+    baseurl = '/archive'
+
+    def __init__(self, docroot):
+
+        self.docroot = docroot
+        self.addresses = _addresses(docroot)
+        self.synthetic = os.path.isfile(
+            os.path.join(docroot, archive.MARKER))
+
+        levels = [a.count('/') for a in self.addresses]
+        self.leaf = self.addresses[levels.index(max(levels))]
+
+        middles = [a for (a, level) in zip(self.addresses, levels)
+                   if level == max(levels) // 2]
+        paired = [a for a in middles
+                  if os.path.isdir(os.path.join(docroot, a))]
+        self.middle = (paired or middles)[0]
+
+
+@benchmark
+def page_init_index(ctx):
+    return lambda: Page(ctx.docroot, ctx.baseurl)
+
+
+@benchmark
+def page_init_leaf(ctx):
+    return lambda: Page(ctx.docroot, ctx.baseurl, ctx.leaf)
+
+
+@benchmark
+def content(ctx):
+    return Page(ctx.docroot, ctx.baseurl, ctx.middle).content
+
+
+@benchmark
+def children(ctx):
+    return Page(ctx.docroot, ctx.baseurl, ctx.middle).children
+
+
+@benchmark
+def siblings(ctx):
+    return Page(ctx.docroot, ctx.baseurl, ctx.middle).siblings
+
+
+@benchmark
+def breadcrumbs(ctx):
+    return Page(ctx.docroot, ctx.baseurl, ctx.leaf).breadcrumbs
+
+
+def _template(page):
+    """Call the Page methods a page template uses, one by one."""
+
+    page.title()
+    page.content()
+    page.heading_index()
+    page.unref_figs()
+    page.breadcrumbs()
+    page.previous()
+    page.nextpage()
+    page.parent_link()
+    page.sibling_links()
+    page.child_links()
+    page.thumbnail()
+
+
+@benchmark
+def template_methods(ctx):
+    page = Page(ctx.docroot, ctx.baseurl, ctx.middle)
+    return lambda: _template(page)
+
+
+@benchmark
+def template_context(ctx):
+    return Page(ctx.docroot, ctx.baseurl, ctx.middle).context
+
+
+@benchmark
+def gallery_pictures(ctx):
+    if not ctx.synthetic:
+        return None
+    return Gallery(ctx.docroot, ctx.baseurl, archive.GALLERY).pictures
+
+
+@benchmark
+def gallery_page_by_date(ctx):
+    """The first page of a gallery in date order, the order warm."""
+
+    if not ctx.synthetic:
+        return None
+
+    gallery = Gallery(ctx.docroot, ctx.baseurl, archive.GALLERY)
+    return lambda: gallery.pictures(limit=50, order='exif_date')
+
+
+@benchmark
+def accession_pictures(ctx):
+    """Thumbnails made from nothing: derivatives and hashes removed."""
+
+    if not ctx.synthetic:
+        return None
+
+    gallery = Gallery(ctx.docroot, ctx.baseurl, archive.GALLERY)
+
+    for key in ('1024px', '512px'):
+        shutil.rmtree(os.path.join(
+            gallery.dirpath, settings.FILEMAP_PICTURES[key][0]), True)
+
+    statedir = os.path.join(ctx.docroot, settings.STATE_DIR)
+    for name in (settings.HASH_OBJECTS, settings.EXIF_INDEX):
+        shutil.rmtree(os.path.join(statedir, name), True)
+    try:
+        os.remove(os.path.join(statedir, settings.HASH_INDEX))
+    except OSError:
+        pass
+
+    return gallery.accession_pictures
+
+
+def _addresses(docroot):
+    """Return the addresses of the pages in an archive, top down."""
+
+    addresses = []
+    for (dirpath, dirnames, fnames) in os.walk(docroot):
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if d[0] != '.' and d + '/' not in settings.META)
+
+        path = dirpath[len(docroot):].strip('/')
+        for fname in sorted(fnames):
+            (basename, ext) = os.path.splitext(fname)
+            if fname[0] == '.' or ext.lower() not in settings.SUFFIX['page']:
+                continue
+            if path or basename != 'index':
+                addresses.append(os.path.join(path, basename))
+
+    return addresses
+
+
+def commit():
+    """Return the git commit of the tree being measured, or None."""
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE,
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the change in each median against a baseline.
+
+    Return the names of benchmarks slower by more than threshold times.
+
+    """
+
+    slower = []
+    print
+    print '%-22s %10s %10s %7s' % ('benchmark', 'baseline', 'now', 'ratio')
+
+    for (name, stats) in sorted(results['results'].items()):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['median']
+        ratio = stats['median'] / before if before else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = 'SLOWER'
+            slower.append(name)
+        print '%-22s %10.6f %10.6f %7.2f %s' % (
+            name, before, stats['median'], ratio, flag)
+
+    return slower
+
+
+def measure(setup, ctx, repeat):
+    """Run a benchmark repeat times, return a dictionary of statistics.
+
+    setup is called before each run, untimed, to get the callable to
+    time. If it returns None, the benchmark does not apply to this
+    archive, and None is returned.
+
+    """
+
+    times = []
+    for n in range(repeat):
+        function = setup(ctx)
+        if function is None:
+            return None
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+
+    times.sort()
+
+    return {
+        'repeat': repeat,
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+    }
+
+
+def run(ctx, repeat, only=None):
+    """Run the registered benchmarks, return {name: statistics}."""
+
+    results = {}
+    for (name, setup) in BENCHMARKS:
+        if only and name not in only:
+            continue
+        stats = measure(setup, ctx, repeat)
+        if stats is None:
+            continue
+        results[name] = stats
+        print '%-22s %10.6f' % (name, stats['median'])
+
+    return results
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                        choices=[name for (name, setup) in BENCHMARKS])
+    parser.add_argument('--docroot',
+                        help='Archive to use, generated if missing.')
+    parser.add_argument('--output', help='Write the results as JSON.')
+    parser.add_argument('--compare', help='JSON results to compare with.')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    archive.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    shape = archive.from_arguments(args)
+
+    temporary = None
+    if args.docroot:
+        docroot = args.docroot
+        if not os.path.isdir(docroot):
+            shape.make(docroot)
+    else:
+        temporary = tempfile.mkdtemp(prefix='webnote-bench-')
+        docroot = shape.make(os.path.join(temporary, 'archive'))
+
+    try:
+        ctx = Context(docroot)
+        meta = {
+            'date': datetime.datetime.now().isoformat(),
+            'commit': commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pages': len(ctx.addresses),
+        }
+        if ctx.synthetic:
+            meta['archive'] = archive.read_parameters(docroot)
+        else:
+            meta['docroot'] = os.path.abspath(docroot)
+
+        results = {
+            'meta': meta,
+            'results': run(ctx, args.repeat, args.only),
+        }
+    finally:
+        if temporary:
+            shutil.rmtree(temporary, True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Render pages from many threads at once, and check for cross-talk.
+
+    python benchmarks/threads.py [--threads 32] [--rounds 5]
+
+Every page of manual/ is rendered once in turn, and the results kept:
+the content, title, navigation links, warnings and metadata of each.
+Then the threads are started together, and each renders every page,
+in an order of its own, for some rounds. A render which differs from
+the serial one means state was shared between threads, a warning
+landing on another request's page, say, or a cache read half made.
+The differences are listed and the script exits with status 1.
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from page import Page
+import settings
+
+
+DOCROOT = os.path.join(ROOT, 'manual')
+BASEURL = '/manual'
+
+
+def addresses(docroot):
+    """Return the addresses of the pages in an archive, top down."""
+
+    found = ['']
+    for (dirpath, dirnames, fnames) in os.walk(docroot):
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if d[0] != '.' and d + '/' not in settings.META)
+
+        path = dirpath[len(docroot):].strip('/')
+        for fname in sorted(fnames):
+            (basename, ext) = os.path.splitext(fname)
+            if fname[0] == '.' or ext.lower() not in settings.SUFFIX['page']:
+                continue
+            if path or basename != 'index':
+                found.append(os.path.join(path, basename))
+
+    return found
+
+
+def render(address):
+    """Return a dictionary of what a request for a page would show."""
+
+    page = Page(DOCROOT, BASEURL, address)
+
+    result = {
+        'content': page.content(),
+        'title': page.title(),
+        'breadcrumbs': page.breadcrumbs(),
+        'child_links': page.child_links(),
+        'sibling_links': page.sibling_links() if page.address else None,
+        'metadata': sorted(page.metadata.metadata.items()),
+        'metadata_warnings': list(page.metadata.warnings),
+    }
+
+    # Warnings last, as rendering adds to them.
+    result['warnings'] = list(page.warnings)
+
+    return result
+
+
+def differences(expected, result):
+    """Return the names of the keys whose values differ."""
+
+    return sorted(
+        key for key in expected if expected[key] != result.get(key))
+
+
+def stress(pages, expected, threads, rounds):
+    """Render pages from threads at once, rounds times in each.
+
+    Return a list of (thread, address, keys) tuples, for each render
+    which differed from expected.
+
+    """
+
+    start = threading.Event()
+    lock = threading.Lock()
+    mismatches = []
+
+    def work(n):
+        order = list(pages)
+        shuffle = random.Random(n).shuffle
+        start.wait()
+
+        for r in range(rounds):
+            shuffle(order)
+            for address in order:
+                try:
+                    keys = differences(expected[address], render(address))
+                except Exception as e:
+                    keys = ['raised %s: %s' % (e.__class__.__name__, e)]
+                if keys:
+                    with lock:
+                        mismatches.append((n, address, keys))
+
+    workers = [threading.Thread(target=work, args=(n, ))
+               for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join()
+
+    return mismatches
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=32,
+                        help='Threads rendering at once.')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Times each thread renders every page.')
+    args = parser.parse_args(argv)
+
+    pages = addresses(DOCROOT)
+    expected = dict((address, render(address)) for address in pages)
+
+    mismatches = stress(pages, expected, args.threads, args.rounds)
+
+    print '%d pages, %d threads, %d renders, %d differed' % (
+        len(pages), args.threads, len(pages) * args.threads * args.rounds,
+        len(mismatches))
+
+    for (n, address, keys) in mismatches:
+        print '    thread %2d %-40s %s' % (n, address or '/', ', '.join(keys))
+
+    if mismatches:
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
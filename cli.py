@@ -0,0 +1,148 @@
+"""webnote.cli. Maintenance commands for a webnote archive.
+
+    python cli.py index <docroot>
+    python cli.py dedup <docroot> [--link] [--dry-run]
+    python cli.py worker <docroot> [--workers N] [--once]
+    python cli.py jobs <docroot> [--status STATUS]
+    python cli.py watch <docroot> [--poll]
+    python cli.py manifest <docroot> [--full]
+
+"""
+
+import argparse
+import logging
+import sys
+
+from hashstore import HashStore
+from jobs import JobQueue, run_workers
+from manifest import Manifest
+from metaindex import MetadataIndex
+from watcher import Watcher
+
+
+def dedup(args):
+    """Report identical pictures, and optionally hard link them."""
+
+    store = HashStore(args.docroot)
+    try:
+        groups = store.scan()
+
+        for digest in sorted(groups):
+            print digest
+            for filename in groups[digest]:
+                print '   ', filename
+
+        if args.link or args.dry_run:
+            linked = store.link_duplicates(dry_run=args.dry_run)
+            for (filename, original) in linked:
+                print 'link', filename, '->', original
+            if args.dry_run:
+                print len(linked), 'files would be linked.'
+            else:
+                print len(linked), 'files linked.'
+    finally:
+        store.close()
+
+
+def index(args):
+    """Bring the metadata index up to date."""
+
+    metaindex = MetadataIndex(args.docroot)
+    try:
+        print metaindex.refresh(), 'pages indexed.'
+    finally:
+        metaindex.close()
+
+
+def jobs(args):
+    """List recent jobs on the queue, and how they are going."""
+
+    queue = JobQueue(args.docroot)
+    try:
+        for job in queue.jobs(status=args.status):
+            print '%6d %-8s %-12s %3d%% %s' % (
+                job['id'], job['status'], job['kind'],
+                int(job['progress'] * 100), job['message'] or '')
+    finally:
+        queue.close()
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='webnote')
+    commands = parser.add_subparsers()
+
+    command = commands.add_parser('index', help=index.__doc__)
+    command.add_argument('docroot')
+    command.set_defaults(func=index)
+
+    command = commands.add_parser('dedup', help=dedup.__doc__)
+    command.add_argument('docroot')
+    command.add_argument('--link', action='store_true',
+                         help='Replace duplicates with hard links.')
+    command.add_argument('--dry-run', action='store_true',
+                         help='List the links, but make none.')
+    command.set_defaults(func=dedup)
+
+    command = commands.add_parser('worker', help=worker.__doc__)
+    command.add_argument('docroot')
+    command.add_argument('--workers', type=int,
+                         help='Number of worker processes.')
+    command.add_argument('--once', action='store_true',
+                         help='Stop when the queue is empty.')
+    command.set_defaults(func=worker)
+
+    command = commands.add_parser('jobs', help=jobs.__doc__)
+    command.add_argument('docroot')
+    command.add_argument('--status',
+                         choices=('pending', 'running', 'done', 'failed'))
+    command.set_defaults(func=jobs)
+
+    command = commands.add_parser('watch', help=watch.__doc__)
+    command.add_argument('docroot')
+    command.add_argument('--poll', action='store_true',
+                         help='Poll for changes, rather than use inotify.')
+    command.set_defaults(func=watch)
+
+    command = commands.add_parser('manifest', help=manifest.__doc__)
+    command.add_argument('docroot')
+    command.add_argument('--full', action='store_true',
+                         help='List every directory, changed or not.')
+    command.set_defaults(func=manifest)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+def manifest(args):
+    """Record the archive in its manifest, or bring that up to date."""
+
+    archive = Manifest(args.docroot)
+    try:
+        print archive.update(full=args.full), 'files in the manifest.'
+    finally:
+        archive.close()
+
+
+def watch(args):
+    """Keep the indexes up to date as the archive changes."""
+
+    logging.basicConfig(level=logging.INFO)
+
+    watcher = Watcher(args.docroot, poll=args.poll)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def worker(args):
+    """Do queued jobs, in worker processes."""
+
+    run_workers(args.docroot, args.workers, once=args.once)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""webnote.derivatives. Files derived from pictures and GPX files.
+
+When a picture is uploaded it wants 512 and 1024 pixel copies, and
+its EXIF data summarised for the index. A GPX file wants its routes,
+tracks and waypoints summarised. None of this needs to hold up the
+request which delivered the file, so enqueue() puts it on the
+webnote.jobs.JobQueue, or hands it to a background thread if
+settings.BACKGROUND_JOBS is off.
+
+Summaries are written as JSON into the STATE_DIR, named by the content
+hash of the file they describe.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import Queue
+import threading
+
+from gpxfile import GPXFile
+from jobs import JobQueue
+import settings
+import utils
+
+
+logger = logging.getLogger(__name__)
+
+#   Work waiting for the background thread, as (filename, docroot,
+#   digest) tuples. The thread is started on first use.
+_queue = Queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def digest_file(filename):
+    """Return the sha256 hexdigest of a file's contents."""
+
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def enqueue(filename, docroot, digest=None):
+    """Queue the derivatives of a file, to be made in the background.
+
+    Return False if the file has no derivatives. Otherwise return the
+    id of its job on the webnote.jobs.JobQueue, or True if it was
+    handed to the background thread.
+
+    """
+
+    if not has_derivatives(filename):
+        return False
+
+    if settings.BACKGROUND_JOBS:
+        queue = JobQueue(docroot)
+        try:
+            return queue.enqueue(
+                'derivatives', filename=filename, digest=digest)
+        finally:
+            queue.close()
+
+    _start_worker()
+    _queue.put((filename, docroot, digest))
+
+    return True
+
+
+def exif_summary(picture):
+    """Return a dictionary of the EXIF values webnote uses."""
+
+    exif = picture.read_exif()
+
+    summary = {
+        'filename': picture.fname,
+        'datetime': None,
+        'camera': None,
+        'latitude': picture.GPSlatitude(),
+        'longitude': picture.GPSlongitude(),
+        'altitude': picture.GPSaltitude(),
+    }
+
+    if 'Image DateTime' in exif:
+        summary['datetime'] = picture.EXIFdatetime().isoformat()
+    if 'Image Model' in exif:
+        summary['camera'] = str(exif['Image Model']).strip()
+
+    return summary
+
+
+def has_derivatives(filename):
+    """True if the file is of a type which has derivatives."""
+
+    (basename, ext) = os.path.splitext(filename)
+    ext = ext.lower()
+
+    return ext in settings.SUFFIX['pictures'] or ext in settings.SUFFIX['gpx']
+
+
+def make_derivatives(filename, docroot, digest=None):
+    """Make the derivatives of one file, now.
+
+    Pictures get thumbnail copies and an EXIF summary, shared with
+    any identical picture elsewhere in the archive through the
+    webnote.hashstore.HashStore. GPX files get a summary of their
+    contents. Return a list of the files written.
+
+    """
+
+    (basename, ext) = os.path.splitext(filename)
+    ext = ext.lower()
+
+    if not digest:
+        digest = digest_file(filename)
+
+    written = []
+
+    if ext in settings.SUFFIX['pictures']:
+        # Imported here, as hashstore uses the summaries in this module.
+        from hashstore import HashStore
+
+        store = HashStore(docroot)
+        try:
+            written += store.derivatives(filename, digest)
+        finally:
+            store.close()
+
+    if ext in settings.SUFFIX['gpx']:
+        with open(filename) as f:
+            summary = GPXFile(f).analyse()
+        written.append(write_summary(
+            docroot, settings.GPX_INDEX, digest, summary))
+
+    for item in written:
+        utils.invalidate(item)
+
+    return written
+
+
+def read_summary(docroot, index, digest):
+    """Return the summary stored under a digest, or None."""
+
+    filename = summary_filename(docroot, index, digest)
+
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def summary_filename(docroot, index, digest):
+    return os.path.join(
+        docroot, settings.STATE_DIR, index, digest + '.json')
+
+
+def write_summary(docroot, index, digest, summary):
+    """Write a summary as JSON, return the filename."""
+
+    filename = summary_filename(docroot, index, digest)
+    path = os.path.dirname(filename)
+
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+    utils.atomic_write(filename, json.dumps(summary, default=str))
+
+    return filename
+
+
+def _start_worker():
+
+    global _worker
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_work, name='webnote-derivatives')
+            _worker.daemon = True
+            _worker.start()
+
+
+def _work():
+    """Make derivatives from the queue, forever."""
+
+    while True:
+        (filename, docroot, digest) = _queue.get()
+        try:
+            make_derivatives(filename, docroot, digest)
+        except Exception:
+            logger.exception('Derivatives failed for %s', filename)
+        finally:
+            _queue.task_done()
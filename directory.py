@@ -1,12 +1,190 @@
 """Classes implimenting the simple filesystem syntax.
 """
 
+import array
+import bisect
+import errno
 import getpass
+import itertools
 import os
 import settings
+import threading
+import timing
 
+import utils
 from webnote import Webnote
 
+#   scandir tells directories from files without a stat of each, which
+#   counts on a network filesystem. It is in os from Python 3.5, and in
+#   the scandir package before that. Without either, each entry is
+#   statted. It is called through its module, so that webnote.fscount
+#   can count it.
+if hasattr(os, 'scandir'):
+    _scandir = os
+else:
+    try:
+        import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+#   Listings of meta directories, shared between Directory objects.
+#   Keyed by pathname, each value is a (mtime, frozenset) tuple. Hold
+#   the lock to read or write it.
+_meta_listings = {}
+_meta_listings_lock = threading.Lock()
+
+
+def _invalidate_listings(path):
+    """Drop any cached meta listing affected by a change at path."""
+
+    path = os.path.normpath(path)
+
+    with _meta_listings_lock:
+        _meta_listings.pop(path, None)
+        _meta_listings.pop(os.path.dirname(path), None)
+
+
+utils.add_invalidation_hook(_invalidate_listings)
+
+#   The categories of a directory listing, besides the keys of
+#   settings.SUFFIX.
+LISTING_CATEGORIES = ('dirs', 'hidden', 'temp', 'unknown')
+
+#   (categories, bits) for each set of settings.SUFFIX keys seen, so
+#   that every DirectoryModel shares them.
+_categories_cache = {}
+
+
+def _categories():
+    """Return (categories, bits), the categories and the bit of each."""
+
+    key = tuple(settings.SUFFIX)
+    cached = _categories_cache.get(key)
+
+    if cached is None:
+        categories = LISTING_CATEGORIES + tuple(sorted(key))
+        bits = dict((category, 1 << n)
+                    for (n, category) in enumerate(categories))
+        cached = (categories, bits)
+        _categories_cache[key] = cached
+
+    return cached
+
+
+class DirectoryModel(object):
+    """The files of a directory, by category.
+
+    This is Directory.model. It reads as a dictionary of lists:
+    model['figures'] is the list of figure files, model['dirs'] the
+    subdirectories, and model['all'] the whole listing.
+
+    Most of the thirty or so categories are empty in any directory, so
+    rather than keep a list for each, it keeps the listing once, and a
+    bitmask of the categories of each entry. Entries of the same kind
+    share a mask, so each entry only holds a two byte index into a
+    table of the distinct masks. The list for a category is made the
+    first time it is asked for, and kept. The lists are shared, and
+    should not be changed.
+
+    """
+
+    __slots__ = (
+        'bits',
+        'categories',
+        'codes',
+        'masks',
+        'names',
+        '_views',
+    )
+
+    def __init__(self, names, categories, bits, masks, codes):
+
+        self.names = names
+        self.categories = categories
+        self.bits = bits
+        self.masks = masks
+        self.codes = codes
+        self._views = None
+
+    def __contains__(self, category):
+        return category == 'all' or category in self.bits
+
+    def __getitem__(self, category):
+
+        if category == 'all':
+            return self.names
+
+        if self._views is None:
+            self._views = {}
+
+        view = self._views.get(category)
+
+        if view is None:
+            view = list(self.iternames(category))
+            self._views[category] = view
+
+        return view
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.categories) + 1
+
+    def _codes(self, category):
+        """Return the set of mask codes of the entries in a category."""
+
+        bit = self.bits[category]
+
+        return frozenset(
+            code for (code, mask) in enumerate(self.masks) if mask & bit)
+
+    def count(self, category):
+        """Return the number of entries in a category, without a list."""
+
+        if category == 'all':
+            return len(self.names)
+
+        if self._views and category in self._views:
+            return len(self._views[category])
+
+        wanted = self._codes(category)
+        if not wanted:
+            return 0
+
+        return sum(1 for code in self.codes if code in wanted)
+
+    def get(self, category, default=None):
+
+        if category in self:
+            return self[category]
+
+        return default
+
+    def items(self):
+        return [(category, self[category]) for category in self.keys()]
+
+    def iternames(self, category):
+        """Iterate over the names in a category, without making a list."""
+
+        if category == 'all':
+            return iter(self.names)
+
+        if self._views and category in self._views:
+            return iter(self._views[category])
+
+        wanted = self._codes(category)
+        if not wanted:
+            return iter(())
+
+        return (name for (name, code)
+                in itertools.izip(self.names, self.codes)
+                if code in wanted)
+
+    def keys(self):
+        return list(self.categories) + ['all']
+
 
 class Directory(Webnote):
     """Provide directory services.
@@ -17,6 +195,10 @@ class Directory(Webnote):
 
     The attribute baseurl is used to construct urls.
 
+    A directory may hold tens of thousands of files. The lists take
+    offset, limit and after arguments, to give one page of the files
+    at a time, in order of name. See names().
+
     """
 
     address = None
@@ -25,15 +207,16 @@ class Directory(Webnote):
     baseurl = None
     sort = None
 
+    _names = None
+    _meta_listing = None
+    _page_order = None
+
     def __init__(self, dirpath, docroot=None, baseurl=None, sort=True):
         """Create a Directory object from a string path to directory.
 
         The address is computed by cutting the docroot from the dirpath.
         """
 
-        if not os.path.isdir(dirpath):
-            raise self.ParseDirNotFound(dirpath)
-
         if docroot:
             if docroot[-1] == '/':
                 docroot = docroot[:-1]
@@ -48,9 +231,11 @@ class Directory(Webnote):
         if baseurl:
             self.baseurl = baseurl
 
+        self.warnings = []
         self.dirpath = dirpath
         self.sort = sort
-        self.model = self._parse_directory(dirpath)
+        with timing.phase('directory.parse', dirpath):
+            self.model = self._parse_directory(dirpath)
 
     class ParseDirNotFound(Exception):
         def __init__(self, value):
@@ -63,65 +248,88 @@ class Directory(Webnote):
         return self.dirpath
 
     def _parse_directory(self, dirpath):
-        """Return a dictionary containing lists of files by type.
+        """Return a DirectoryModel of the files by type.
 
-        It looks for keys in the settings.SUFFIX variable. The output
-        dictionary will have elemements corresponding to the keys of
-        this dictionary. It will also contain elements "dirs",
-        "hidden" and "all".
+        It looks for keys in the settings.SUFFIX variable. The model
+        will have elemements corresponding to the keys of this
+        dictionary. It will also contain elements "dirs", "hidden",
+        "temp", "unknown" and "all".
 
         Hidden files start with a period. Temporary files end with a
         tilde.
         """
 
-        if not os.path.isdir(dirpath):
-            raise self.ParseDirNotFound(dirpath)
+        (categories, bits) = _categories()
+
+        # Listing the directory finds out whether it is there, without
+        # a stat first.
+        try:
+            if _scandir:
+                listing = []
+                subdirs = set()
+                for entry in _scandir.scandir(dirpath):
+                    listing.append(entry.name)
+                    if entry.is_dir():
+                        subdirs.add(entry.name)
+                isdir = subdirs.__contains__
+            else:
+                listing = os.listdir(dirpath)
+                isdir = lambda item: os.path.isdir(
+                    os.path.join(dirpath, item))
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                raise self.ParseDirNotFound(dirpath)
+            raise
 
-        output = {
-            'dirs': [],
-            'hidden': [],
-            'temp': [],
-            'unknown': [],
-        }
+        if self.sort:
+            listing.sort()
 
-        for key in settings.SUFFIX:
-            output[key] = []
+        masks = []
+        codes = array.array('H')
 
-        if self.sort:
-            listing = sorted(os.listdir(dirpath))
-        else:
-            listing = os.listdir(dirpath)
+        # Entries of the same kind share their mask, and files with the
+        # same extension their lookup in settings.SUFFIX.
+        mask_codes = {}
+        ext_masks = {}
 
         for item in listing:
             if item[0] == '.':
-                output['hidden'].append(item)
+                mask = bits['hidden']
 
             elif item[-1] == '~':
-                output['temp'].append(item)
+                mask = bits['temp']
 
-            elif os.path.isdir(os.path.join(dirpath, item)):
-                output['dirs'].append(item)
+            elif isdir(item):
+                mask = bits['dirs']
 
             else:
                 basename, ext = os.path.splitext(item)
-                found = False
-                for key in settings.SUFFIX:
-                    if ext.lower() in settings.SUFFIX[key]:
-                        output[key].append(item)
-                        found = True
-                if not found:
-                    output['unknown'].append(item)
-
-        output['all'] = listing
-
-        return output
-
-    def all_files(self, baseurl=None):
+                ext = ext.lower()
+                mask = ext_masks.get(ext)
+                if mask is None:
+                    mask = 0
+                    for key in settings.SUFFIX:
+                        if ext in settings.SUFFIX[key]:
+                            mask |= bits[key]
+                    if not mask:
+                        mask = bits['unknown']
+                    ext_masks[ext] = mask
+
+            code = mask_codes.get(mask)
+            if code is None:
+                code = len(masks)
+                mask_codes[mask] = code
+                masks.append(mask)
+            codes.append(code)
+
+        return DirectoryModel(listing, categories, bits, tuple(masks), codes)
+
+    def all_files(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying all files."""
 
         targets = []
 
-        for item in self.model['all']:
+        for item in self.names('all', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
@@ -140,31 +348,31 @@ class Directory(Webnote):
 
         return name
 
-    def datafiles(self, baseurl=None):
+    def datafiles(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying data files."""
 
         targets = []
 
-        for item in self.model['data']:
+        for item in self.names('data', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def documents(self, baseurl=None):
+    def documents(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying document files."""
 
         targets = []
 
-        for item in self.model['docs']:
+        for item in self.names('docs', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def figures(self, baseurl=''):
+    def figures(self, baseurl='', offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying figure files."""
 
         targets = []
@@ -173,62 +381,170 @@ class Directory(Webnote):
             if self.baseurl:
                 baseurl = self.baseurl
 
-        for item in self.model['figures']:
+        for item in self.names('figures', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def hiddenfiles(self, baseurl=None):
+    def hiddenfiles(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying hidden files."""
 
         targets = []
 
-        for item in self.model['hidden']:
+        for item in self.names('hidden', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def hiresimages(self, baseurl=None):
+    def hiresimages(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying image files."""
 
         images = []
 
-        for item in self.model['img_hires']:
+        for item in self.names('img_hires', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             images.append((link, text))
 
         return images
 
-    def htmlfiles(self, baseurl=None):
+    def htmlfiles(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying all html files."""
 
         targets = []
 
-        for item in self.model['html']:
+        for item in self.names('html', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def metafiles(self, baseurl=None):
+    def has_file(self, name):
+        """True if the named entry is in this directory's listing."""
+
+        if self._names is None:
+            self._names = frozenset(self.model['all'])
+
+        return name in self._names
+
+    def meta_listing(self):
+        """Return a set of the filenames in the meta subdirectory.
+
+        The listing is read once, and shared with other Directory
+        objects for the same path until the meta directory's
+        modification time changes. A directory without a meta
+        subdirectory returns an empty set, without touching the disk.
+
+        """
+
+        if self._meta_listing is not None:
+            return self._meta_listing
+
+        listing = frozenset()
+        metadir = settings.META[0].strip('/')
+
+        if metadir in self.model['dirs']:
+            path = os.path.normpath(os.path.join(self.dirpath, metadir))
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                mtime = None
+
+            if mtime is not None:
+                with _meta_listings_lock:
+                    cached = _meta_listings.get(path)
+                if cached and cached[0] == mtime:
+                    listing = cached[1]
+                else:
+                    listing = frozenset(os.listdir(path))
+                    with _meta_listings_lock:
+                        _meta_listings[path] = (mtime, listing)
+
+        self._meta_listing = listing
+        return listing
+
+    def metafiles(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying meta files."""
 
         targets = []
 
-        for item in self.model['']:
+        for item in self.names('', offset, limit, after):
             link = os.path.join(baseurl, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def pages(self, baseurl=None, suffix=None):
+    def names(self, category='all', offset=0, limit=None, after=None,
+              reverse=False):
+        """Return a list of the names in a category, a page at a time.
+
+        Without arguments this is model[category], the whole category
+        in the order of the listing. Otherwise the names are in order
+        of name, reversed with reverse set. after, the last name of the
+        page before, gives the names after it in that order, as a
+        cursor which stays put as files come and go. Then offset names
+        are skipped, and at most limit are given.
+
+        The listing of a directory made with sort set, as it is by
+        default, is already in order, so a page is found by bisection
+        and a slice. Otherwise the names are sorted first.
+
+        """
+
+        if not offset and limit is None and after is None and not reverse:
+            return self.model[category]
+
+        ordered = self.model[category]
+        if not self.sort:
+            ordered = sorted(ordered)
+
+        if reverse:
+            if after is None:
+                end = len(ordered)
+            else:
+                end = bisect.bisect_left(ordered, after)
+            end = max(end - offset, 0)
+            start = 0
+            if limit is not None:
+                start = max(end - limit, 0)
+            return ordered[start:end][::-1]
+
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(ordered, after)
+        start += offset
+        if limit is None:
+            return ordered[start:]
+        return ordered[start:start + limit]
+
+    def page_order(self, reverse=False):
+        """Return (pages, positions) for the page files in this directory.
+
+        pages is the list of page filenames in display order, reversed
+        for the sort reverse command. positions maps each filename to
+        its index in that list, so a page finds its neighbours without
+        searching. Each order is computed once.
+
+        """
+
+        if self._page_order is None:
+            self._page_order = {}
+
+        if reverse not in self._page_order:
+            pages = sorted(self.model['page'], reverse=reverse)
+            positions = dict((name, n) for (n, name) in enumerate(pages))
+            self._page_order[reverse] = (pages, positions)
+
+        return self._page_order[reverse]
+
+    def pages(self, baseurl=None, suffix=None,
+              offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying page files."""
 
         targets = []
@@ -243,7 +559,7 @@ class Directory(Webnote):
             else:
                 baseurl = ''
 
-        for item in self.model['page']:
+        for item in self.names('page', offset, limit, after):
             (basename, ext) = os.path.splitext(item)
             link = os.path.join(baseurl, basename) + '/'
             if suffix:
@@ -277,38 +593,129 @@ class Directory(Webnote):
         
         return reftext, unref_figs
 
-    def tempfiles(self, baseurl=None):
+    def tempfiles(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying temporary files."""
 
         targets = []
 
-        for item in self.model['']:
+        for item in self.names('', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def textfiles(self, baseurl=None):
+    def textfiles(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying text files."""
 
         targets = []
 
-        for item in self.model['text']:
+        for item in self.names('text', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
 
-    def unknownfiles(self, baseurl=None):
+    def unknownfiles(self, baseurl=None, offset=0, limit=None, after=None):
         """Return a list of (link, text) tuples identifying  files."""
 
         targets = []
 
-        for item in self.model['unknown']:
+        for item in self.names('unknown', offset, limit, after):
             link = os.path.join(baseurl, self.address, item)
             text = item
             targets.append((link, text))
 
         return targets
+
+    @classmethod
+    def walk(cls, top, docroot=None, baseurl=None, sort=True, maxdepth=None,
+             prune=None, followlinks=False, workers=None):
+        """Generate a Directory for top and each directory below it.
+
+        Directories are given top down, each before those below it,
+        and in sorted order with sort set, as os.walk() gives them. The
+        listing of each is classified by its model, as for any
+        Directory. Hidden and temporary directories, which are not in
+        model['dirs'], are not descended into.
+
+        With workers more than one, settings.WALK_WORKERS by default,
+        the directories are listed ahead of the caller by a pool of
+        that many threads. On a network filesystem, where each listing
+        waits on the server, this is much faster than listing them one
+        at a time. On a local disk the threads only add overhead.
+
+        maxdepth limits the levels below top, 0 giving top alone.
+        prune is a callable taking the pathname of a directory and
+        the name of a subdirectory, returning True if the subdirectory
+        is not to be descended into. Symbolic links to directories are
+        not followed, unless followlinks is set.
+
+        Directories which can't be listed, or which go while being
+        walked, are left out, as os.walk() leaves them.
+
+        """
+
+        if not workers:
+            workers = settings.WALK_WORKERS
+
+        def scan(dirpath):
+            try:
+                return cls(dirpath, docroot=docroot, baseurl=baseurl,
+                           sort=sort)
+            except (cls.ParseDirNotFound, OSError):
+                return None
+
+        # Directories still to be given, as [dirpath, depth, future]
+        # lists, the next last. Only the next lookahead of them are
+        # being listed at any time, so a large archive isn't held in
+        # memory waiting for a slow caller.
+        lookahead = workers * 4
+        pending = [[top, 0, None]]
+
+        def ahead():
+            if executor:
+                for item in pending[-1:-lookahead - 1:-1]:
+                    if item[2] is None:
+                        item[2] = executor.submit(scan, item[0])
+
+        # With one worker, each directory is listed as it is reached,
+        # without the cost of handing it to a thread.
+        executor = None
+        if workers > 1:
+            # Imported here, as only walking in parallel needs it.
+            from concurrent.futures import ThreadPoolExecutor
+
+            executor = ThreadPoolExecutor(workers)
+
+        try:
+            while pending:
+                ahead()
+                (dirpath, depth, future) = pending.pop()
+                if future:
+                    directory = future.result()
+                else:
+                    directory = scan(dirpath)
+                if directory is None:
+                    continue
+
+                if maxdepth is None or depth < maxdepth:
+                    below = []
+                    for name in directory.model['dirs']:
+                        if prune and prune(dirpath, name):
+                            continue
+                        path = os.path.join(dirpath, name)
+                        if not followlinks and os.path.islink(path):
+                            continue
+                        below.append([path, depth + 1, None])
+                    pending.extend(reversed(below))
+
+                ahead()
+                yield directory
+        finally:
+            for item in pending:
+                if item[2] is not None:
+                    item[2].cancel()
+            if executor:
+                executor.shutdown(wait=False)
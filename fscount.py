@@ -0,0 +1,181 @@
+"""webnote.fscount. Count the filesystem calls an operation makes.
+
+Most of the cost of building a page is stats, directory listings and
+opens. Counting them gives a measure which, unlike a timing, is the
+same on every machine, and so can be held to a budget:
+
+    with fscount.counting() as calls:
+        Page(docroot, baseurl, 'Examples/blog/entry1').content()
+
+    calls.assert_at_most(stat=40, listdir=8)
+
+An operation which goes over budget raises
+FilesystemCalls.BudgetExceeded, listing the calls of each kind over,
+so a redundant walk shows up where it was introduced. See
+benchmarks/fsbudget.py for the budgets kept for webnote itself.
+
+The counts are made by replacing os.stat, os.lstat, os.fstat,
+os.listdir, os.open and the builtin open while counting. The
+os.path tests, isfile, isdir, exists, getmtime and the like, and
+os.walk, are counted as the stats and listdirs they make. scandir,
+from os or the scandir package, is counted as a listdir, so a listing
+counts the same whichever is used. The entries it gives tell
+directories from files without a stat, so where it is available an
+operation may make fewer stats. The replacements are process wide,
+so calls made by other threads in the meantime are counted too.
+
+"""
+
+import __builtin__
+import os
+import threading
+
+
+#   The kinds of call counted, and where each is found.
+CALLS = [
+    ('fstat', os, 'fstat'),
+    ('listdir', os, 'listdir'),
+    ('lstat', os, 'lstat'),
+    ('open', __builtin__, 'open'),
+    ('os.open', os, 'open'),
+    ('stat', os, 'stat'),
+]
+
+if hasattr(os, 'scandir'):
+    CALLS.append(('listdir', os, 'scandir'))
+else:
+    try:
+        import scandir
+    except ImportError:
+        pass
+    else:
+        CALLS.append(('listdir', scandir, 'scandir'))
+
+#   FilesystemCalls objects counting at the moment, and the originals
+#   of the functions replaced while any are, by (module, name). Hold
+#   the lock to change either.
+_counters = []
+_originals = {}
+_lock = threading.Lock()
+
+
+class FilesystemCalls():
+    """The filesystem calls made during an operation.
+
+    calls['stat'] is the number of stats, and calls.paths['stat'] the
+    list of paths they were made on, in order. total() adds up every
+    kind.
+
+    """
+
+    def __init__(self):
+
+        self.counts = dict((kind, 0) for (kind, module, name) in CALLS)
+        self.paths = dict((kind, []) for (kind, module, name) in CALLS)
+
+    def __getitem__(self, kind):
+        return self.counts[kind]
+
+    def __repr__(self):
+        return '<FilesystemCalls %s>' % ', '.join(
+            '%s %d' % (kind, self.counts[kind])
+            for kind in sorted(self.counts) if self.counts[kind])
+
+    class BudgetExceeded(AssertionError):
+        def __init__(self, value):
+            self.value = value
+
+        def __str__(self):
+            return repr(self.value)
+
+    def add(self, kind, path):
+        self.counts[kind] += 1
+        self.paths[kind].append(path)
+
+    def assert_at_most(self, **budget):
+        """Raise BudgetExceeded if any kind of call went over budget.
+
+        The budget is given as keyword arguments, stat=40 and so on.
+        Kinds not named are not limited. The exception's value is a
+        dictionary of {kind: (count, budget, paths)} for each kind over.
+
+        """
+
+        over = {}
+        for (kind, limit) in budget.items():
+            if self.counts[kind] > limit:
+                over[kind] = (self.counts[kind], limit, self.paths[kind])
+
+        if over:
+            raise self.BudgetExceeded(over)
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+class _Counting():
+    """Count calls into a FilesystemCalls, as counting() says."""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __enter__(self):
+
+        with _lock:
+            if not _counters:
+                _install()
+            _counters.append(self.calls)
+
+        return self.calls
+
+    def __exit__(self, kind, value, traceback):
+
+        with _lock:
+            _counters.remove(self.calls)
+            if not _counters:
+                _uninstall()
+
+        return False
+
+
+def counting(calls=None):
+    """Return a context manager counting filesystem calls.
+
+    It gives the FilesystemCalls object which counts them, a new one
+    unless calls is given. Counting nests: each call is added to every
+    FilesystemCalls counting at the time.
+
+    """
+
+    if calls is None:
+        calls = FilesystemCalls()
+
+    return _Counting(calls)
+
+
+def _counted(kind, original):
+    """Return a replacement for original, counting its calls as kind."""
+
+    def replacement(path='.', *args, **kwargs):
+        for calls in list(_counters):
+            calls.add(kind, path)
+        return original(path, *args, **kwargs)
+
+    replacement.__name__ = original.__name__
+    replacement.__doc__ = original.__doc__
+
+    return replacement
+
+
+def _install():
+
+    for (kind, module, name) in CALLS:
+        original = getattr(module, name)
+        _originals[(module, name)] = original
+        setattr(module, name, _counted(kind, original))
+
+
+def _uninstall():
+
+    for (kind, module, name) in CALLS:
+        setattr(module, name, _originals.pop((module, name)))
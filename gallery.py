@@ -4,12 +4,12 @@
 
 import datetime
 import os
-import pytz
-import subprocess
 
 from directory import Directory
+from hashstore import HashStore
+from jobs import JobQueue
 from picture import Picture
-from PIL import Image
+from pictureorder import PictureOrder
 
 import settings
 
@@ -21,6 +21,7 @@ class Gallery():
     baseurl = None
     address = None
     gallery = None
+    jobs = None
 
     def __init__(self, docroot, baseurl, address):
         """Build the data structure describing this gallery."""
@@ -44,6 +45,13 @@ class Gallery():
         def __str__(self):
             return repr(self.value)
 
+    class OrderNotKnown(Exception):
+        def __init__(self, value):
+            self.value = value
+
+        def __str__(self):
+            return repr(self.value)
+
     def __get_absolute_url__(self):
         return os.path.join(self.baseurl, self.address)
 
@@ -54,8 +62,22 @@ class Gallery():
 
         return self.paired.model['gpx']
 
-    def pictures(self, docroot=None, baseurl=None):
-        """Return a list of picture objects."""
+    def pictures(self, docroot=None, baseurl=None, offset=0, limit=None,
+                 order='name', after=None):
+        """Return a list of picture objects, a page at a time.
+
+        Without offset, limit or after, every picture is given, in the
+        order of the listing. order is 'name', or 'exif_date' for the
+        order the pictures were taken in, kept by a
+        webnote.pictureorder.PictureOrder. after is a cursor, from
+        cursor(), giving the pictures after the last of the page
+        before. Then offset pictures are skipped, and at most limit
+        given. Only the pictures given are opened, and they share the
+        listing of the gallery. A bare name as a cursor in date order
+        raises webnote.pictureorder.PictureOrder.CursorNotFound if the
+        picture has gone.
+
+        """
 
         pictures = []
         if not docroot:
@@ -63,19 +85,60 @@ class Gallery():
         if not baseurl:
             baseurl = self.baseurl
 
-        for pic in self.paired.model['pictures']:
+        if order == 'name':
+            names = self.paired.names('pictures', offset, limit, after)
+        elif order == 'exif_date':
+            store = PictureOrder(self.docroot)
+            try:
+                names = store.window(self.paired, offset, limit, after)
+            finally:
+                store.close()
+        else:
+            raise self.OrderNotKnown(order)
+
+        # The pictures share the listing of the gallery, rather than
+        # each listing it again, unless they are to be addressed
+        # differently.
+        parent = None
+        if (docroot, baseurl) == (self.docroot, self.baseurl):
+            parent = self.paired
+
+        for pic in names:
             fname = os.path.join(self.dirpath, pic)
-            picture = Picture(fname, docroot=docroot, baseurl=baseurl)
+            picture = Picture(fname, docroot=docroot, baseurl=baseurl,
+                              parent=parent)
             pictures.append(picture)
 
         return pictures
 
-    def accession_pictures(self):
+    def accession_pictures(self, progress=None, background=None):
         """Process pictures into thumbnails.
 
-        For each picture file
+        For each picture file, make 1024 and 512 pixel copies. The
+        copies are shared, through a webnote.hashstore.HashStore, with
+        any identical picture elsewhere in the archive, so a picture
+        which has been seen before costs a hash, not a resize.
+
+        If progress is given, it is called with the fraction done and
+        the name of each picture, as webnote.jobs workers expect.
+
+        This can take a long time. With background set, or by default
+        with settings.BACKGROUND_JOBS, it is put on the job queue by
+        queue_accession(), for a worker, and only a warning naming the
+        job is returned. The job's id is added to the jobs attribute.
+
         """
 
+        if background is None:
+            background = settings.BACKGROUND_JOBS
+
+        if background:
+            job = self.queue_accession()
+            if self.jobs is None:
+                self.jobs = []
+            self.jobs.append(job)
+            return ["Thumbnail copies queued, as job %d." % job]
+
         warnings = []
 
         if not os.path.isdir(self.d1024()):
@@ -86,19 +149,17 @@ class Gallery():
             warnings.append("Creating directory at " + self.d512())
             os.mkdir(self.d512())
 
-        for picture in self.paired.model['pictures']:
-            path = os.path.join(self.dirpath, picture)
-            (basename, ext) = os.path.splitext(picture)
-            f1024 = basename + '_1024px' + ext.lower()
-            path1024 = os.path.join(self.dirpath, self.d1024(), f1024)
-            f512 = basename + '_512px' + ext.lower()
-            path512 = os.path.join(self.dirpath, self.d512(), f512)
-            if os.path.isfile(path):
-                i = Image.open(path)
-                i.thumbnail((1024, 1024))
-                i.save(path1024, "jpeg")
-                i.thumbnail((512, 512))
-                i.save(path512, "jpeg")
+        pictures = self.paired.model['pictures']
+        store = HashStore(self.docroot)
+        try:
+            for (n, picture) in enumerate(pictures):
+                if progress:
+                    progress(float(n) / len(pictures), picture)
+                path = os.path.join(self.dirpath, picture)
+                if os.path.isfile(path):
+                    store.derivatives(path)
+        finally:
+            store.close()
 
         warnings.append("Creating thumbnail copies.")
 
@@ -120,6 +181,25 @@ class Gallery():
 
         return False
 
+    def cursor(self, picture, order='name'):
+        """Return the cursor of a page ending with picture.
+
+        Given to pictures() as after, with the same order, it gives the
+        page following. It stays put as pictures come and go.
+
+        """
+
+        if order == 'name':
+            return picture.fname
+        elif order == 'exif_date':
+            store = PictureOrder(self.docroot)
+            try:
+                return store.cursor(self.paired, picture.fname)
+            finally:
+                store.close()
+
+        raise self.OrderNotKnown(order)
+
     def d1024(self):
         """Pathname to 1024px directory."""
         return os.path.join(
@@ -131,7 +211,7 @@ class Gallery():
             self.dirpath, settings.FILEMAP_PICTURES['512px'][0],
         )
 
-    def process_gps(self, pictime, gpstime, tzoffset):
+    def process_gps(self, pictime, gpstime, tzoffset, background=None):
         """Run gpscorrelate against gpx files found in this directory.
 
         pictime will be naive, gpstime will be UTC.
@@ -159,6 +239,15 @@ class Gallery():
            create a picture of your GPS device showing the current time and
            compare it with the timestamp of your photo file.
 
+        The commands are run on the absolute path of this directory,
+        so a worker started in another directory finds the files.
+
+        With background set, or by default with
+        settings.BACKGROUND_JOBS, the correlation is put on the job
+        queue by queue_gps(), for a worker, and only a line naming the
+        job is returned. The job's id is added to the jobs attribute,
+        and the job's result is the list of outputs.
+
         """
 
         warnings = []
@@ -173,6 +262,18 @@ class Gallery():
             warnings.append("No correlation performed.")
             return warnings
 
+        if background is None:
+            background = settings.BACKGROUND_JOBS
+
+        if background:
+            job = self.queue_gps(pictime, gpstime, tzoffset)
+            if self.jobs is None:
+                self.jobs = []
+            self.jobs.append(job)
+            return ["GPS correlation queued, as job %d." % job]
+
+        dirpath = os.path.abspath(self.dirpath)
+
         photooffset = pictime - gpstime
         photooffset = photooffset.seconds
 
@@ -201,22 +302,26 @@ class Gallery():
         for gpxfile in self.gpxfiles():
 
             gpxfname = os.path.join(
-                self.dirpath, gpxfile.replace(' ', '\ ')
+                dirpath, gpxfile.replace(' ', '\ ')
             )
             command = precom + gpxfname
 
             for ext in extensions:
-                fullcommand = command + " " + self.dirpath + "/*" + ext
+                fullcommand = command + " " + dirpath + "/*" + ext
 
                 commands.append(fullcommand)
 
-#       Execute the commands and return the output.
+#       Execute the commands and return the output. Each runs in this
+#       directory, without changing the working directory of the
+#       whole process.
+        import subprocess
+
         outputs = []
-        os.chdir(self.dirpath)
         for line in commands:
 
             try:
-                output = subprocess.check_output(line, shell=True)
+                output = subprocess.check_output(
+                    line, shell=True, cwd=dirpath)
 
             except subprocess.CalledProcessError:
                 output = "Something went wrong. No correlation was performed."
@@ -224,3 +329,32 @@ class Gallery():
             outputs.append("<pre>" + output + "</pre>")
 
         return outputs
+
+    def queue_accession(self):
+        """Put accession_pictures() on the job queue. Return the job id.
+
+        A worker runs it whatever settings.BACKGROUND_JOBS says. Poll
+        webnote.jobs.JobQueue.status() with the id to follow it.
+
+        """
+
+        queue = JobQueue(self.docroot)
+        try:
+            return queue.enqueue('accession', address=self.address)
+        finally:
+            queue.close()
+
+    def queue_gps(self, pictime, gpstime, tzoffset):
+        """Put process_gps() on the job queue. Return the job id.
+
+        The job's result is the list process_gps() returns.
+
+        """
+
+        queue = JobQueue(self.docroot)
+        try:
+            return queue.enqueue(
+                'gps', address=self.address, pictime=pictime,
+                gpstime=gpstime, tzoffset=tzoffset)
+        finally:
+            queue.close()
@@ -2,7 +2,6 @@
 
 """
 
-import gpxpy
 import os
 
 
@@ -15,7 +14,7 @@ class GPXFile():
     """
 
     gpx = None    # Parsed gpxpy object.
-    warnings = []
+    warnings = None
 
     def __init__(self, gpxfile):
         """Parse the file with gpxpy.
@@ -25,6 +24,10 @@ class GPXFile():
 
         """
 
+        # Imported here, so that loading this module doesn't load gpxpy.
+        import gpxpy
+
+        self.warnings = []
         self.gpxfile = gpxfile
         self.gpx = gpxpy.parse(gpxfile)
 
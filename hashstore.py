@@ -0,0 +1,287 @@
+"""webnote.hashstore. Pictures stored once, by the hash of their content.
+
+The same photograph is often copied into several page directories.
+Each copy would otherwise get its own thumbnail copies, and its own
+EXIF summary. The HashStore keeps one set of derivatives for each
+distinct picture, under the STATE_DIR, and hard links them into each
+gallery which holds a copy.
+
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+
+import derivatives
+from directory import Directory
+from manifest import Manifest
+from picture import Picture
+import settings
+import utils
+
+
+class HashStore():
+    """Content-addressed derivatives, and a register of duplicates.
+
+    ### Usage
+
+        store = HashStore(docroot)
+        store.derivatives(filename)      # thumbnails, shared.
+        store.scan()                     # {digest: [filenames]}
+        store.link_duplicates()          # hard link the copies.
+
+    Digests are remembered in a sqlite database, against the size and
+    modification time of each file, so a file is only hashed again
+    when it changes.
+
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS files (
+            filename TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            digest TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS files_digest ON files (digest)",
+    )
+
+    # Derivative key in settings.FILEMAP_PICTURES, and pixel size.
+    SIZES = (
+        ('1024px', 1024),
+        ('512px', 512),
+    )
+
+    docroot = None
+    connection = None
+
+    def __init__(self, docroot, dbfile=None):
+
+        if docroot[-1] == '/':
+            docroot = docroot[:-1]
+
+        statedir = os.path.join(docroot, settings.STATE_DIR)
+        if not dbfile:
+            dbfile = os.path.join(statedir, settings.HASH_INDEX)
+        _makedirs(os.path.dirname(dbfile))
+
+        self.docroot = docroot
+        self.objects = os.path.join(statedir, settings.HASH_OBJECTS)
+
+        self.connection = sqlite3.connect(dbfile)
+        self.connection.text_factory = str
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def _link(self, source, target):
+        """Put a hard link to source at target, or a copy if we can't.
+
+        Return True if target was changed.
+
+        """
+
+        try:
+            if os.path.samefile(source, target):
+                return False
+        except OSError:
+            pass
+
+        # Named for the thread as well as the process, as a threaded
+        # server may link the same target twice at once.
+        tempname = os.path.join(os.path.dirname(target), '.%s.%d.%d~' % (
+            os.path.basename(target), os.getpid(),
+            threading.current_thread().ident))
+
+        try:
+            os.link(source, tempname)
+        except OSError:
+            shutil.copyfile(source, tempname)
+
+        os.rename(tempname, target)
+        utils.invalidate(target)
+
+        return True
+
+    def _pictures(self):
+        """Generate the filenames of every picture in the archive.
+
+        Hidden directories, the STATE_DIR among them, and directories
+        of thumbnail copies are skipped. If the archive has a
+        webnote.manifest.Manifest, the pictures are read from that,
+        rather than by walking the archive.
+
+        """
+
+        skip = (settings.FILEMAP_PICTURES['1024px'] +
+                settings.FILEMAP_PICTURES['512px'])
+
+        manifest = Manifest.load(self.docroot)
+        if manifest:
+            try:
+                for filename in manifest.files('pictures', skip=skip):
+                    yield filename
+            finally:
+                manifest.close()
+            return
+
+        for directory in Directory.walk(
+                self.docroot, prune=lambda dirpath, name: name in skip):
+            for fname in directory.model['pictures']:
+                yield os.path.join(directory.dirpath, fname)
+
+    def close(self):
+        self.connection.close()
+
+    def derivatives(self, filename, digest=None):
+        """Make or share the thumbnail copies of a picture.
+
+        The copies are made once for each distinct picture, in the
+        object directory for its digest, then linked into the 1024px
+        and 512px directories beside the picture. The EXIF summary is
+        likewise written once for each digest.
+
+        Return a list of the files written or linked.
+
+        """
+
+        if not digest:
+            digest = self.digest(filename)
+
+        (path, fname) = os.path.split(filename)
+        (basename, ext) = os.path.splitext(fname)
+        objdir = self.object_dir(digest)
+
+        img = None
+        written = []
+
+        for (key, pixels) in self.SIZES:
+            shared = os.path.join(objdir, key + '.jpg')
+
+            if not os.path.isfile(shared):
+                if img is None:
+                    from PIL import Image
+
+                    img = Image.open(filename)
+                    if img.mode not in ('RGB', 'L'):
+                        img = img.convert('RGB')
+                    _makedirs(objdir)
+                img.thumbnail((pixels, pixels))
+                tempname = '%s.%d.%d~' % (
+                    shared, os.getpid(), threading.current_thread().ident)
+                img.save(tempname, "jpeg")
+                os.rename(tempname, shared)
+
+            target_dir = os.path.join(path, settings.FILEMAP_PICTURES[key][0])
+            _makedirs(target_dir)
+            target = os.path.join(
+                target_dir, basename + '_' + key + ext.lower())
+
+            if self._link(shared, target):
+                written.append(target)
+
+        if not derivatives.read_summary(
+                self.docroot, settings.EXIF_INDEX, digest):
+            picture = Picture(filename, docroot=self.docroot)
+            written.append(derivatives.write_summary(
+                self.docroot, settings.EXIF_INDEX, digest,
+                derivatives.exif_summary(picture)))
+
+        return written
+
+    def digest(self, filename, commit=True):
+        """Return the sha256 digest of a file, hashing only if it changed."""
+
+        stat = os.stat(filename)
+
+        row = self.connection.execute(
+            "SELECT size, mtime, digest FROM files WHERE filename = ?",
+            (filename, )).fetchone()
+
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        digest = derivatives.digest_file(filename)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (filename, stat.st_size, stat.st_mtime, digest))
+
+        if commit:
+            self.connection.commit()
+
+        return digest
+
+    def duplicates(self):
+        """Return {digest: [filenames]} for pictures held more than once."""
+
+        groups = {}
+        for (digest, filename) in self.connection.execute(
+                "SELECT digest, filename FROM files WHERE digest IN"
+                " (SELECT digest FROM files GROUP BY digest"
+                "  HAVING count(*) > 1)"
+                " ORDER BY digest, filename"):
+            groups.setdefault(digest, []).append(filename)
+
+        return groups
+
+    def link_duplicates(self, dry_run=False):
+        """Replace duplicate pictures with hard links to a single copy.
+
+        In each group of identical pictures, the first by filename is
+        kept, and the others become links to it. Return a list of
+        (filename, original) tuples for the files linked, or which
+        would be with dry_run set.
+
+        """
+
+        linked = []
+
+        for (digest, filenames) in sorted(self.duplicates().items()):
+            original = filenames[0]
+            for filename in filenames[1:]:
+                if os.path.samefile(original, filename):
+                    continue
+                if not dry_run:
+                    self._link(original, filename)
+                linked.append((filename, original))
+
+        return linked
+
+    def object_dir(self, digest):
+        """Return the directory holding derivatives for a digest."""
+
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def scan(self):
+        """Hash every picture in the archive, and report duplicates.
+
+        Forget pictures which have gone. Return the same structure as
+        duplicates().
+
+        """
+
+        seen = set()
+        for filename in self._pictures():
+            self.digest(filename, commit=False)
+            seen.add(filename)
+
+        for (filename, ) in self.connection.execute(
+                "SELECT filename FROM files").fetchall():
+            if filename not in seen:
+                self.connection.execute(
+                    "DELETE FROM files WHERE filename = ?", (filename, ))
+
+        self.connection.commit()
+
+        return self.duplicates()
+
+
+def _makedirs(path):
+
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
@@ -0,0 +1,433 @@
+"""webnote.jobs. A local queue for slow archive maintenance.
+
+Making thumbnails, correlating pictures with GPS tracks and rebuilding
+indexes take far longer than a web request should. They are put on a
+JobQueue instead, and done by worker processes.
+
+The queue is a sqlite database in the STATE_DIR, so it needs no
+broker, survives restarts, and is shared by every process serving the
+archive. Run workers with:
+
+    python cli.py worker <docroot>
+
+"""
+
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import time
+
+import settings
+
+
+class JobQueue():
+    """A persistent queue of jobs, each with a kind and arguments.
+
+    ### Usage
+
+        queue = JobQueue(docroot)
+        job_id = queue.enqueue('accession', address='Photos/2017')
+        queue.status(job_id)
+
+    Enqueueing a job identical to one which is waiting or running
+    returns the id of that job, rather than adding another. A job
+    which raises an exception is retried, after a delay, up to
+    settings.JOB_ATTEMPTS times in all.
+
+    A job passes through the states pending, running, and then done
+    or failed.
+
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            args TEXT,
+            key TEXT,
+            status TEXT,
+            progress REAL,
+            message TEXT,
+            result TEXT,
+            attempts INTEGER,
+            worker TEXT,
+            created REAL,
+            updated REAL,
+            not_before REAL
+        )""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (key)
+            WHERE status IN ('pending', 'running')""",
+        "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)",
+    )
+
+    FIELDS = (
+        'id', 'kind', 'args', 'key', 'status', 'progress', 'message',
+        'result', 'attempts', 'worker', 'created', 'updated', 'not_before',
+    )
+
+    docroot = None
+    connection = None
+
+    def __init__(self, docroot, dbfile=None):
+
+        if docroot[-1] == '/':
+            docroot = docroot[:-1]
+
+        if not dbfile:
+            statedir = os.path.join(docroot, settings.STATE_DIR)
+            if not os.path.isdir(statedir):
+                try:
+                    os.mkdir(statedir)
+                except OSError:
+                    pass
+            dbfile = os.path.join(statedir, settings.JOB_QUEUE)
+
+        self.docroot = docroot
+        self.dbfile = dbfile
+
+        # Transactions are begun explicitly, so that claiming a job is
+        # atomic across processes.
+        self.connection = sqlite3.connect(
+            dbfile, timeout=30, isolation_level=None)
+        self.connection.text_factory = str
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+
+    def _record(self, row):
+        """Return a job row as a dictionary, with its args decoded."""
+
+        if not row:
+            return None
+
+        job = dict(zip(self.FIELDS, row))
+        job['args'] = json.loads(job['args'])
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+
+        return job
+
+    def claim(self, worker):
+        """Take the oldest job that is ready, and mark it running.
+
+        Jobs left running for longer than settings.JOB_TIMEOUT, whose
+        worker has presumably died, are put back in the queue first.
+        Return the job as a dictionary, or None if there is nothing
+        to do.
+
+        """
+
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute(
+                "UPDATE jobs SET status = 'pending', worker = NULL"
+                " WHERE status = 'running' AND updated < ?",
+                (now - settings.JOB_TIMEOUT, ))
+
+            row = self.connection.execute(
+                "SELECT " + ', '.join(self.FIELDS) + " FROM jobs"
+                " WHERE status = 'pending' AND not_before <= ?"
+                " ORDER BY id LIMIT 1", (now, )).fetchone()
+
+            if row:
+                self.connection.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?,"
+                    " attempts = attempts + 1, updated = ? WHERE id = ?",
+                    (worker, now, row[0]))
+
+            self.connection.execute("COMMIT")
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+
+        if row:
+            return self.status(row[0])
+
+        return None
+
+    def close(self):
+        self.connection.close()
+
+    def complete(self, job_id, result=None):
+        """Mark a job done, storing its result."""
+
+        self.connection.execute(
+            "UPDATE jobs SET status = 'done', progress = 1.0, result = ?,"
+            " updated = ? WHERE id = ?",
+            (json.dumps(result, default=str), time.time(), job_id))
+
+    def enqueue(self, kind, **args):
+        """Add a job, and return its id.
+
+        If an identical job, of the same kind with the same arguments,
+        is already waiting or running, return its id instead.
+
+        The arguments are stored as JSON. Datetimes are stored as
+        strings, which handlers read back with _datetime().
+
+        """
+
+        args = json.dumps(args, sort_keys=True, default=_encode)
+        key = kind + ' ' + args
+        now = time.time()
+
+        # The identical job may finish between a failed insert and the
+        # select, in which case there is nothing to find, and the job
+        # is inserted again.
+        while True:
+            try:
+                cursor = self.connection.execute(
+                    "INSERT INTO jobs (kind, args, key, status, progress,"
+                    " attempts, created, updated, not_before)"
+                    " VALUES (?, ?, ?, 'pending', 0.0, 0, ?, ?, ?)",
+                    (kind, args, key, now, now, now))
+                return cursor.lastrowid
+
+            except sqlite3.IntegrityError:
+                row = self.connection.execute(
+                    "SELECT id FROM jobs WHERE key = ?"
+                    " AND status IN ('pending', 'running')",
+                    (key, )).fetchone()
+                if row:
+                    return row[0]
+
+    def fail(self, job_id, message):
+        """Record a failed attempt at a job.
+
+        The job goes back in the queue, to be tried again after a
+        delay which doubles with each attempt, unless it has used up
+        settings.JOB_ATTEMPTS. Return True if it will be retried.
+
+        """
+
+        job = self.status(job_id)
+        now = time.time()
+
+        if job['attempts'] < settings.JOB_ATTEMPTS:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+            self.connection.execute(
+                "UPDATE jobs SET status = 'pending', worker = NULL,"
+                " message = ?, updated = ?, not_before = ? WHERE id = ?",
+                (message, now, now + delay, job_id))
+            return True
+
+        self.connection.execute(
+            "UPDATE jobs SET status = 'failed', message = ?, updated = ?"
+            " WHERE id = ?", (message, now, job_id))
+        return False
+
+    def jobs(self, status=None, limit=100):
+        """Return a list of the most recent jobs, as dictionaries."""
+
+        sql = "SELECT " + ', '.join(self.FIELDS) + " FROM jobs"
+        values = []
+
+        if status:
+            sql += " WHERE status = ?"
+            values.append(status)
+
+        sql += " ORDER BY id DESC LIMIT ?"
+        values.append(limit)
+
+        return [self._record(row)
+                for row in self.connection.execute(sql, values)]
+
+    def progress(self, job_id, fraction, message=None):
+        """Record how far through a running job is, from 0.0 to 1.0."""
+
+        self.connection.execute(
+            "UPDATE jobs SET progress = ?, message = ?, updated = ?"
+            " WHERE id = ?", (fraction, message, time.time(), job_id))
+
+    def status(self, job_id):
+        """Return a job as a dictionary, or None if there is no such job.
+
+        This is the call for polling a job. The dictionary has the
+        keys in FIELDS: status, progress and message say how it is
+        going, and result holds what the job returned once done.
+
+        """
+
+        row = self.connection.execute(
+            "SELECT " + ', '.join(self.FIELDS) + " FROM jobs WHERE id = ?",
+            (job_id, )).fetchone()
+
+        return self._record(row)
+
+
+class Worker():
+    """Take jobs from a JobQueue and do them.
+
+    Each kind of job is done by the handler of that name in HANDLERS.
+    A handler is called with the docroot, a progress callable taking
+    (fraction, message), and the job's arguments, and returns a result
+    which can be stored as JSON.
+
+    """
+
+    docroot = None
+    queue = None
+    name = None
+
+    def __init__(self, docroot):
+
+        self.docroot = docroot
+        self.queue = JobQueue(docroot)
+        self.name = socket.gethostname() + ':' + str(os.getpid())
+
+    def run(self, once=False, poll=None):
+        """Do jobs until the queue is empty, if once is set, or forever.
+
+        When there is nothing to do, wait poll seconds, defaulting to
+        settings.JOB_POLL, before looking again.
+
+        """
+
+        if not poll:
+            poll = settings.JOB_POLL
+
+        while True:
+            if not self.work_one():
+                if once:
+                    return
+                time.sleep(poll)
+
+    def work_one(self):
+        """Claim and do a single job. Return False if there was none."""
+
+        job = self.queue.claim(self.name)
+        if not job:
+            return False
+
+        def progress(fraction, message=None):
+            self.queue.progress(job['id'], fraction, message)
+
+        try:
+            handler = HANDLERS[job['kind']]
+            args = dict(
+                (str(k), _utf8(v)) for (k, v) in job['args'].items())
+            result = handler(self.docroot, progress, **args)
+        except Exception as e:
+            self.queue.fail(job['id'], '%s: %s' % (e.__class__.__name__, e))
+        else:
+            self.queue.complete(job['id'], result)
+
+        return True
+
+
+def run_workers(docroot, workers=None, once=False):
+    """Run a number of Worker processes, and wait for them.
+
+    workers defaults to settings.JOB_WORKERS, or one for each CPU.
+
+    """
+
+    # Imported here, as only running the workers needs it.
+    import multiprocessing
+
+    if not workers:
+        workers = settings.JOB_WORKERS
+    if not workers:
+        workers = multiprocessing.cpu_count()
+
+    processes = []
+    for n in range(workers):
+        process = multiprocessing.Process(
+            target=_run_worker, args=(docroot, once))
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+def _run_worker(docroot, once):
+    Worker(docroot).run(once=once)
+
+
+def _encode(value):
+    """Encode a value json can't, for enqueue()."""
+
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            import pytz
+
+            value = value.astimezone(pytz.utc)
+            return value.strftime('%Y-%m-%d %H:%M:%S') + '+00:00'
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+
+    return str(value)
+
+
+def _datetime(value):
+    """Read back a datetime stored in a job's arguments as a string.
+
+    Aware datetimes are stored in UTC, with a '+00:00' suffix.
+
+    """
+
+    if not value:
+        return None
+
+    tzinfo = None
+    if value.endswith('+00:00'):
+        import pytz
+
+        value = value[:-6]
+        tzinfo = pytz.utc
+
+    dt = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+    return dt.replace(tzinfo=tzinfo)
+
+
+def _utf8(value):
+    """Return JSON strings as utf-8 str, like the rest of webnote."""
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return value
+
+
+#   Job handlers. Imports are made inside each, as the modules they
+#   use in turn import this one to enqueue jobs.
+
+def accession(docroot, progress, address):
+    from gallery import Gallery
+
+    return Gallery(docroot, '', address).accession_pictures(
+        progress, background=False)
+
+
+def derivatives(docroot, progress, filename, digest=None):
+    import derivatives
+
+    return derivatives.make_derivatives(filename, docroot, digest)
+
+
+def gps(docroot, progress, address, pictime, gpstime, tzoffset):
+    from gallery import Gallery
+
+    return Gallery(docroot, '', address).process_gps(
+        _datetime(pictime), _datetime(gpstime), tzoffset, background=False)
+
+
+def index(docroot, progress):
+    from metaindex import MetadataIndex
+
+    metaindex = MetadataIndex(docroot)
+    try:
+        return metaindex.refresh()
+    finally:
+        metaindex.close()
+
+
+HANDLERS = {
+    'accession': accession,
+    'derivatives': derivatives,
+    'gps': gps,
+    'index': index,
+}
@@ -0,0 +1,466 @@
+"""webnote.manifest. A record of every file in an archive, for warm starts.
+
+Indexing, deduplication and the like each used to begin by walking
+the whole archive, listing every directory and statting every file.
+The manifest keeps the result of that walk in the STATE_DIR: for each
+file its categories, as a Directory would list it, its size,
+modification time and content hash, and for each page the metafile
+which describes it. A new process opens the manifest in a few
+milliseconds, and the database is read through a memory map.
+
+The manifest is verified lazily. As each directory is reached, it is
+statted, and only those whose modification time has changed since
+they were recorded are listed again. Adding, removing or renaming a
+file changes the modification time of its directory, and so do the
+edits webnote makes, which replace files through a rename. A file
+changed in place by another program leaves its directory alone, and
+is not noticed until its directory changes, or update() is run with
+full set.
+
+"""
+
+import itertools
+import os
+import sqlite3
+
+import derivatives
+from directory import Directory
+from metadata import Metadata
+import settings
+
+
+class Manifest():
+    """The directories and files of an archive, kept in sqlite.
+
+    ### Usage
+
+        manifest = Manifest(docroot)
+        manifest.update()                   # record the archive.
+
+        manifest = Manifest.load(docroot)   # None if there is none.
+        for filename in manifest.files('page', skip=('meta', )):
+            ...
+
+    Directories are recorded with their modification time, and that
+    of their meta directory, which holds the metafiles of their pages.
+    Files are recorded by directory, with the bitmask of their
+    categories from Directory.model. Hidden and temporary files, and
+    hidden directories, the STATE_DIR among them, are left out.
+
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            metamtime REAL
+        )""",
+        """CREATE TABLE IF NOT EXISTS entries (
+            dir TEXT,
+            name TEXT,
+            mask INTEGER,
+            size INTEGER,
+            mtime REAL,
+            metafile TEXT,
+            digest TEXT,
+            PRIMARY KEY (dir, name)
+        )""",
+        """CREATE TABLE IF NOT EXISTS properties (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""",
+    )
+
+    # Bump this when the tables change shape, so that old manifests
+    # are rebuilt.
+    VERSION = 1
+
+    docroot = None
+    manifestfile = None
+    connection = None
+    bits = None
+    categories = None
+
+    def __init__(self, docroot, manifestfile=None):
+        """Open, or create, the manifest of the archive at docroot."""
+
+        if not os.path.isdir(docroot):
+            raise self.DocrootNotFound(docroot)
+
+        if docroot[-1] == '/':
+            docroot = docroot[:-1]
+
+        if not manifestfile:
+            manifestfile = self.filename(docroot)
+            statedir = os.path.dirname(manifestfile)
+            if not os.path.isdir(statedir):
+                os.mkdir(statedir)
+
+        self.docroot = docroot
+        self.manifestfile = manifestfile
+
+        # The manifest is a cache, which verifying repairs, so commits
+        # need not wait for the disk.
+        self.connection = sqlite3.connect(manifestfile, timeout=30)
+        self.connection.text_factory = str
+        self.connection.execute(
+            "PRAGMA mmap_size = %d" % settings.MANIFEST_MMAP)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+
+        # The categories of the root listing are those of every
+        # listing. If they have changed since the manifest was written,
+        # its masks mean nothing, and it is started again.
+        model = Directory(docroot, sort=False).model
+        self.bits = model.bits
+        self.categories = ' '.join(model.categories)
+
+        if self._property('categories') != self.categories or \
+                self._property('version') != str(self.VERSION):
+            self.clear()
+
+        self.connection.commit()
+
+    class DocrootNotFound(Exception):
+        def __init__(self, value):
+            self.value = value
+
+        def __str__(self):
+            return repr(self.value)
+
+    def _absolute(self, relpath):
+
+        if relpath:
+            return os.path.join(self.docroot, relpath)
+
+        return self.docroot
+
+    def _forget(self, relpath):
+        """Remove a directory, and everything below it, from the manifest.
+
+        Paths below relpath are those between relpath + '/' and
+        relpath + '0', '0' being the character after '/'.
+
+        """
+
+        if relpath:
+            (low, high) = (relpath + '/', relpath + '0')
+            self.connection.execute(
+                "DELETE FROM directories"
+                " WHERE path = ? OR (path >= ? AND path < ?)",
+                (relpath, low, high))
+            self.connection.execute(
+                "DELETE FROM entries"
+                " WHERE dir = ? OR (dir >= ? AND dir < ?)",
+                (relpath, low, high))
+        else:
+            self.connection.execute("DELETE FROM directories")
+            self.connection.execute("DELETE FROM entries")
+
+        self.connection.commit()
+
+    def _metamtime(self, dirpath):
+        """Return the modification time of the meta directory, or None."""
+
+        try:
+            return os.stat(os.path.join(dirpath, settings.META[0])).st_mtime
+        except OSError:
+            return None
+
+    def _property(self, key):
+
+        row = self.connection.execute(
+            "SELECT value FROM properties WHERE key = ?", (key, )).fetchone()
+
+        if row:
+            return row[0]
+
+        return None
+
+    def _relative(self, path):
+        """Return the path below the docroot, '' for the docroot itself."""
+
+        return path[len(self.docroot) + 1:]
+
+    def _relocate(self, dirpath):
+        """Find again the metafiles of the pages paired with dirpath.
+
+        A page's metafile may be in its paired directory, which is
+        verified after the directory holding the page.
+
+        """
+
+        (parent, name) = os.path.split(dirpath)
+        parentrel = self._relative(parent)
+
+        for (pagename, metafile) in self.connection.execute(
+                "SELECT name, metafile FROM entries"
+                " WHERE dir = ? AND mask & ?",
+                (parentrel, self.bits['page'])).fetchall():
+
+            if os.path.splitext(pagename)[0] != name:
+                continue
+
+            metadata = Metadata()
+            metadata.pagefile = os.path.join(parent, pagename)
+            found = metadata.locate_metafile()
+            if found:
+                found = self._relative(found)
+
+            if found != metafile:
+                self.connection.execute(
+                    "UPDATE entries SET metafile = ?"
+                    " WHERE dir = ? AND name = ?",
+                    (found, parentrel, pagename))
+
+    def _scan(self, dirpath, mtime):
+        """List a directory again, and record what is in it.
+
+        Digests of files whose size and modification time are as
+        recorded are kept, rather than hashed again. Return a list of
+        (name, mask) tuples for what is in it, in order.
+
+        """
+
+        relpath = self._relative(dirpath)
+
+        try:
+            directory = Directory(dirpath, docroot=self.docroot)
+        except Directory.ParseDirNotFound:
+            self._forget(relpath)
+            return []
+
+        known = {}
+        for row in self.connection.execute(
+                "SELECT name, size, mtime, digest FROM entries WHERE dir = ?",
+                (relpath, )).fetchall():
+            known[row[0]] = row[1:]
+
+        model = directory.model
+        bits = model.bits
+        skip = bits['hidden'] | bits['temp']
+
+        rows = []
+        subdirs = []
+
+        for (name, code) in itertools.izip(model.names, model.codes):
+            mask = model.masks[code]
+            if mask & skip:
+                continue
+
+            filename = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+
+            size = stat.st_size
+            digest = None
+            metafile = None
+
+            if mask & bits['dirs']:
+                subdirs.append(name)
+                size = None
+
+            elif settings.MANIFEST_HASHES:
+                previous = known.get(name)
+                if previous and previous[:2] == (size, stat.st_mtime):
+                    digest = previous[2]
+                if not digest:
+                    try:
+                        digest = derivatives.digest_file(filename)
+                    except IOError:
+                        pass
+
+            if mask & bits['page']:
+                metadata = Metadata()
+                metadata.pagefile = filename
+                metafile = metadata.locate_metafile(directory)
+                if metafile:
+                    metafile = self._relative(metafile)
+
+            rows.append((relpath, name, mask, size, stat.st_mtime,
+                         metafile, digest))
+
+        # Subdirectories which have gone take their records with them.
+        for (name, ) in self.connection.execute(
+                "SELECT name FROM entries WHERE dir = ? AND mask & ?",
+                (relpath, bits['dirs'])).fetchall():
+            if name not in subdirs:
+                self._forget(os.path.join(relpath, name) if relpath else name)
+
+        self.connection.execute(
+            "DELETE FROM entries WHERE dir = ?", (relpath, ))
+        self.connection.executemany(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+            (relpath, mtime, self._metamtime(dirpath)))
+
+        if relpath:
+            self._relocate(dirpath)
+
+        self.connection.commit()
+
+        return [(row[1], row[2]) for row in rows]
+
+    def _walk(self, skip=(), full=False):
+        """Generate (dirpath, entries) for each directory, verifying each.
+
+        entries is a list of (name, mask) tuples, as _scan() returns.
+        See directories().
+
+        """
+
+        recorded = {}
+        for (path, mtime, metamtime) in self.connection.execute(
+                "SELECT path, mtime, metamtime FROM directories").fetchall():
+            recorded[path] = (mtime, metamtime)
+
+        dirbit = self.bits['dirs']
+        pending = [self.docroot]
+
+        while pending:
+            dirpath = pending.pop()
+            relpath = self._relative(dirpath)
+
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                self._forget(relpath)
+                continue
+
+            known = recorded.get(relpath)
+            if full or not known or known[0] != mtime or (
+                    known[1] is not None and
+                    self._metamtime(dirpath) != known[1]):
+                entries = self._scan(dirpath, mtime)
+            else:
+                entries = self.connection.execute(
+                    "SELECT name, mask FROM entries WHERE dir = ?"
+                    " ORDER BY name", (relpath, )).fetchall()
+
+            yield (dirpath, entries)
+
+            for (name, mask) in reversed(entries):
+                if mask & dirbit and name not in skip:
+                    pending.append(os.path.join(dirpath, name))
+
+    def clear(self):
+        """Forget everything recorded, ready to record the archive again."""
+
+        self._forget('')
+        self.connection.execute(
+            "INSERT OR REPLACE INTO properties VALUES ('categories', ?)",
+            (self.categories, ))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO properties VALUES ('version', ?)",
+            (str(self.VERSION), ))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def directories(self, skip=(), full=False):
+        """Generate the pathname of every directory, verifying each.
+
+        Directories are given top down, in sorted order. Each is
+        statted as it is reached, and listed again if it has changed
+        since it was recorded, or hasn't been. Subdirectories named in
+        skip are not descended into, though they stay recorded. With
+        full set, every directory is listed again.
+
+        """
+
+        for (dirpath, entries) in self._walk(skip, full):
+            yield dirpath
+
+    @classmethod
+    def filename(cls, docroot):
+        """Return the filename of the manifest of the archive at docroot."""
+
+        return os.path.join(docroot, settings.STATE_DIR, settings.MANIFEST)
+
+    def files(self, category=None, skip=()):
+        """Generate the pathnames of the files in a category.
+
+        Directories are verified as they are reached, as directories()
+        says. With no category, every file and subdirectory is given.
+
+        """
+
+        bit = None
+        if category:
+            bit = self.bits[category]
+
+        for (dirpath, entries) in self._walk(skip):
+            for (name, mask) in entries:
+                if bit is None or mask & bit:
+                    yield os.path.join(dirpath, name)
+
+    @classmethod
+    def load(cls, docroot):
+        """Return the Manifest of the archive at docroot, if it has one.
+
+        Return None if no manifest has been written, so the caller can
+        walk the archive instead.
+
+        """
+
+        if docroot[-1] == '/':
+            docroot = docroot[:-1]
+
+        if not os.path.isfile(cls.filename(docroot)):
+            return None
+
+        return cls(docroot)
+
+    def record(self, filename):
+        """Return a dictionary of what is recorded for one file.
+
+        The keys are filename, categories, a list, size, mtime,
+        metafile, a pathname or None, and digest. Return None if the
+        file is not recorded. The record is not verified.
+
+        """
+
+        relpath = self._relative(filename)
+        (relpath, name) = os.path.split(relpath)
+
+        row = self.connection.execute(
+            "SELECT mask, size, mtime, metafile, digest FROM entries"
+            " WHERE dir = ? AND name = ?", (relpath, name)).fetchone()
+
+        if not row:
+            return None
+
+        (mask, size, mtime, metafile, digest) = row
+        if metafile:
+            metafile = self._absolute(metafile)
+
+        return {
+            'filename': filename,
+            'categories': [category for category in self.categories.split()
+                           if mask & self.bits[category]],
+            'size': size,
+            'mtime': mtime,
+            'metafile': metafile,
+            'digest': digest,
+        }
+
+    def update(self, full=False):
+        """Verify the whole manifest, and return the number of files.
+
+        With full set, every directory is listed again, and the files
+        changed in place, which verifying alone would miss, are found.
+
+        """
+
+        for dirpath in self.directories(full=full):
+            pass
+
+        return self.connection.execute(
+            "SELECT count(*) FROM entries").fetchone()[0]
@@ -3,8 +3,28 @@
 
 import copy
 import datetime
+import marshal
 import os
 import settings
+import threading
+import timing
+
+import utils
+
+
+def _invalidate_sidecar(path):
+    """Remove the parsed metadata sidecar of a metafile which changed."""
+
+    (dirname, fname) = os.path.split(path)
+
+    if fname.endswith('.meta'):
+        try:
+            os.remove(os.path.join(dirname, '.' + fname + 'c'))
+        except OSError:
+            pass
+
+
+utils.add_invalidation_hook(_invalidate_sidecar)
 
 
 class Metadata():
@@ -88,7 +108,22 @@ class Metadata():
         'type',
     )
 
-    warnings = []
+    # Lowercased metafile keys, mapped to keys of the metadata
+    # structure, so that a line is classified with one lookup.
+    KEYMAP = dict(
+        [(element, element) for element in ELEMENTS + COMMANDS] +
+        [(element.replace('dc_', 'dc.'), element) for element in ELEMENTS]
+    )
+
+    # Bump this when the parsed structures change shape, so that old
+    # sidecar files are ignored.
+    SIDECAR_VERSION = 1
+
+    # The values of every element without any. Held by thousands of
+    # Metadata objects at once, so it is shared, and immutable.
+    EMPTY = ()
+
+    warnings = None
 
     data = None
     filemodel = None
@@ -96,7 +131,7 @@ class Metadata():
     metafilename = None
     pagefile = None
 
-    def __init__(self, pagefile=None, data=None):
+    def __init__(self, pagefile=None, data=None, directory=None):
         """Operations on metadata records.
 
         Instantiation creates a dictionary structure called
@@ -111,40 +146,48 @@ class Metadata():
         command keys, and it will load those values into the metadata
         structure.
 
+        Supply the webnote.Directory object for the directory holding
+        the page, and the metafile will be found from its listings
+        instead of by testing for each candidate file.
+
         """
 
+        self.warnings = []
         metadata = self.build_empty_metadata()
 
         if pagefile:
             self.pagefile = pagefile
-            self.metafilename = self.locate_metafile()
+            self.metafilename = self.locate_metafile(directory)
         else:
             self.pagefile = ''
 
         if self.metafilename:
-            self.filemodel = self.read_metafile()
+            with timing.phase('metadata.read_metafile', self.metafilename):
+                (self.filemodel, self.metadata) = self.load_metafile()
         else:
             self.metadata = metadata
 
-        if self.filemodel:
-            self.metadata = self.process_filemodel(self.filemodel)
-
         if data:
             self.data = data
             self.metadata = self.process_data(data)
 
+    def add_value(self, metadata, element, value):
+        """Add a value to an element of a metadata structure."""
+
+        if metadata[element]:
+            metadata[element].append(value)
+        else:
+            metadata[element] = [value]
+
     def build_empty_metadata(self):
         """Return an empty metadata structure dictionary.
 
-        This is a dictionary of lists, keyed by ELEMENTS and COMMANDS."""
+        This is a dictionary of lists, keyed by ELEMENTS and COMMANDS.
+        Elements without values all share the empty tuple EMPTY, rather
+        than each having an empty list of its own. Use add_value() to
+        add to an element."""
 
-        metadata = {}
-        for element in self.ELEMENTS:
-            metadata[element] = []
-        for element in self.COMMANDS:
-            metadata[element] = []
-
-        return metadata
+        return dict.fromkeys(self.ELEMENTS + self.COMMANDS, self.EMPTY)
 
     def dublincore(self):
 
@@ -195,7 +238,7 @@ class Metadata():
         # there is none, it returns 'default.html'.
         return dir + self.metadata['liststyle'][0] + ext
 
-    def locate_metafile(self):
+    def locate_metafile(self, directory=None):
         """Locate the metafile for the given address.
 
         This follows this process:
@@ -204,11 +247,20 @@ class Metadata():
         -   metafile in the meta directory.
         -   metafile in the paired directory.
 
+        If directory is the webnote.Directory object for the parent
+        directory, the first two are answered from its listings, and
+        the paired directory is only looked at if it exists.
+
         Return None if not file found.
         """
 
         (basename, ext) = os.path.splitext(self.pagefile)
 
+        if directory:
+            (path, last) = os.path.split(basename)
+            if os.path.normpath(directory.dirpath) == os.path.normpath(path):
+                return self._locate_in_directory(directory, basename)
+
         filename = basename + '.meta'
 
         if os.path.isfile(filename):
@@ -230,6 +282,26 @@ class Metadata():
 
         return None
 
+    def _locate_in_directory(self, directory, basename):
+        """Locate the metafile using the listings of the parent directory.
+        """
+
+        (path, last) = os.path.split(basename)
+        metaname = last + '.meta'
+
+        if directory.has_file(metaname):
+            return basename + '.meta'
+
+        if metaname in directory.meta_listing():
+            return os.path.join(path, settings.META[0], metaname)
+
+        if last in directory.model['dirs']:
+            filename = os.path.join(basename, metaname)
+            if os.path.isfile(filename):
+                return filename
+
+        return None
+
     def formdata(self):
         """Return a dictionary suitable for populating forms."""
 
@@ -242,6 +314,53 @@ class Metadata():
 
         return formdata
 
+    def load_metafile(self):
+        """Return (filemodel, metadata) for the metafile.
+
+        If settings.METADATA_SIDECAR is set, the parsed structures are
+        kept in a hidden sidecar file next to the metafile, and read
+        from there for as long as the metafile is unchanged.
+
+        """
+
+        if not settings.METADATA_SIDECAR:
+            return self.parse_metafile()
+
+        try:
+            stat = os.stat(self.metafilename)
+        except OSError:
+            return self.parse_metafile()
+
+        stamp = (self.SIDECAR_VERSION, stat.st_mtime, stat.st_size,
+                 stat.st_ino)
+        sidecar = self.sidecar_filename()
+
+        try:
+            with open(sidecar, 'rb') as f:
+                cached = marshal.load(f)
+            if cached[0] == stamp:
+                return (cached[1], cached[2])
+        except (IOError, EOFError, ValueError, TypeError, IndexError):
+            pass
+
+        (filemodel, metadata) = self.parse_metafile()
+
+        # The sidecar is only a cache. If it can't be written, say in
+        # a read-only archive, carry on without it.
+        tempname = '%s.%d.%d~' % (
+            sidecar, os.getpid(), threading.current_thread().ident)
+        try:
+            with open(tempname, 'wb') as f:
+                marshal.dump((stamp, filemodel, metadata), f)
+            os.rename(tempname, sidecar)
+        except (IOError, OSError, ValueError):
+            try:
+                os.remove(tempname)
+            except OSError:
+                pass
+
+        return (filemodel, metadata)
+
     def metafile_record(self, data=None):
         """Return a string containing a metadata record in text format.
 
@@ -277,6 +396,47 @@ class Metadata():
 
         return record
 
+    def parse_metafile(self):
+        """Read the metafile, and return (filemodel, metadata).
+
+        This reads the file a line at a time, building the filemodel
+        and the metadata structure together, in a single pass. It
+        gives the same result as read_metafile() followed by
+        process_filemodel().
+
+        """
+
+        filemodel = [('filename:', self.metafilename)]
+        metadata = self.build_empty_metadata()
+        metadata['filename:'] = self.metafilename
+        keymap = self.KEYMAP
+
+        with open(self.metafilename) as f:
+            for line in f:
+                if line[0] == '#':
+                    filemodel.append(('comment', line[1:]))
+                    continue
+
+                # The same few keys are in every metafile, so one copy
+                # of each is kept, however many metafiles are held.
+                (key, colon, value) = line.partition(':')
+                key = intern(key.strip())
+                value = value.strip()
+                filemodel.append((key, value))
+
+                element = keymap.get(key.lower())
+                if element:
+                    if metadata[element]:
+                        metadata[element].append(value)
+                    else:
+                        metadata[element] = [value]
+                elif key not in metadata:
+                    metadata[key] = value
+
+        # Copying the dictionary sizes its table to the keys it holds,
+        # a half of the one it grew to as they were added.
+        return (filemodel, dict(metadata))
+
     def preferred_filename(self, fname=None):
         """Return the preferred filename for a new metadata file.
 
@@ -302,7 +462,7 @@ class Metadata():
 
         for element in metadata.keys():
             if element in data.keys():
-                metadata[element].append(data[element])
+                self.add_value(metadata, element, data[element])
 
         return metadata
 
@@ -322,7 +482,7 @@ class Metadata():
             # Is the first element of the line a metadata key?
             elif key in metadata.keys():
                 if len(key):
-                    metadata[key].append(line[1])
+                    self.add_value(metadata, key, line[1])
 
             # Is it a command?
             elif line[0].lower() in self.COMMANDS:
@@ -344,29 +504,18 @@ class Metadata():
 
         """
 
-        metafilename = None
-        record = [('filename:', self.metafilename)]
+        with timing.phase('metadata.read_metafile', self.metafilename):
+            (filemodel, metadata) = self.parse_metafile()
 
-        with open(self.metafilename) as f:
-            contents = f.readlines()
+        return filemodel
 
-        for line in contents:
-            if line[0] == '#':
-                key = 'comment'
-                value = line[1:]
-                record.append((key, value))
-            else:
-                bits = line.split(":")
-                key = bits.pop(0)
-                key = key.strip()
-                value = ':'.join(bits)
-                value = value.strip()
-                record.append((key, value))
+    def save(self, data=None, lock=False):
+        """Save a metarecord to file.
 
-        return record
+        The file is replaced atomically, holding an advisory lock if
+        lock is set. See webnote.utils.atomic_write().
 
-    def save(self, data=None):
-        """Save a metarecord to file."""
+        """
 
         metafilename = None
 
@@ -392,9 +541,20 @@ class Metadata():
 
         record = self.metafile_record()
 
-        f = open(metafilename, 'w')
-        f.write(record)
-        f.close()
+        utils.atomic_write(metafilename, record, lock=lock)
+        self.metafilename = metafilename
+        utils.invalidate(metafilename)
+
+    def sidecar_filename(self):
+        """Return the filename of the parsed metadata sidecar.
+
+        The sidecar is a hidden file alongside the metafile, so it
+        never appears in directory listings.
+
+        """
+
+        (path, fname) = os.path.split(self.metafilename)
+        return os.path.join(path, '.' + fname + 'c')
 
 #   Methods to return individual field values.
     def title(self):
@@ -449,6 +609,11 @@ class Metadata():
     def sort(self):
         return self.metadata['sort'][0]
 
+    def sort_reverse(self):
+        """True if the sort command asks for reverse order."""
+        sort = self.metadata['sort']
+        return len(sort) > 0 and sort[0] == 'reverse'
+
     def subject(self):
         return ', '.join(self.metadata['dc_subject'])
 
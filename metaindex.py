@@ -0,0 +1,318 @@
+"""webnote.metaindex. A persistent index of metadata across an archive.
+
+"""
+
+import os
+import sqlite3
+
+from directory import Directory
+from metadata import Metadata
+import settings
+
+
+class MetadataIndex():
+    """Query pages by Dublin Core fields without opening every metafile.
+
+    The index is a sqlite database, kept by default in the STATE_DIR
+    at the top of the docroot. It holds one row for each page in the
+    archive, with secondary indexes on date, creator, subject, type
+    and status.
+
+    ### Usage
+
+        index = MetadataIndex(docroot)
+        index.refresh()
+        addresses = index.query(creator='Malcolm Hutchinson',
+                                date_from='2017-01-01')
+
+    A refresh walks the archive, or reads its manifest, and reads only
+    those metafiles whose modification time has changed since the last
+    refresh. Queries
+    return lists of page addresses, suitable for handing to
+    webnote.page.Page.
+
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS pages (
+            address TEXT PRIMARY KEY,
+            pagefile TEXT,
+            pagemtime REAL,
+            metafile TEXT,
+            metamtime REAL,
+            title TEXT,
+            date TEXT,
+            doctype TEXT COLLATE NOCASE,
+            status TEXT COLLATE NOCASE
+        )""",
+        """CREATE TABLE IF NOT EXISTS creators (
+            address TEXT,
+            creator TEXT COLLATE NOCASE
+        )""",
+        """CREATE TABLE IF NOT EXISTS subjects (
+            address TEXT,
+            subject TEXT COLLATE NOCASE
+        )""",
+        "CREATE INDEX IF NOT EXISTS pages_date ON pages (date)",
+        "CREATE INDEX IF NOT EXISTS pages_doctype ON pages (doctype)",
+        "CREATE INDEX IF NOT EXISTS pages_status ON pages (status)",
+        "CREATE INDEX IF NOT EXISTS creators_creator ON creators (creator)",
+        "CREATE INDEX IF NOT EXISTS creators_address ON creators (address)",
+        "CREATE INDEX IF NOT EXISTS subjects_subject ON subjects (subject)",
+        "CREATE INDEX IF NOT EXISTS subjects_address ON subjects (address)",
+    )
+
+    docroot = None
+    indexfile = None
+    connection = None
+
+    def __init__(self, docroot, indexfile=None):
+        """Open, or create, the index for the archive at docroot."""
+
+        if not os.path.isdir(docroot):
+            raise self.DocrootNotFound(docroot)
+
+        if docroot[-1] == '/':
+            docroot = docroot[:-1]
+
+        if not indexfile:
+            statedir = os.path.join(docroot, settings.STATE_DIR)
+            if not os.path.isdir(statedir):
+                os.mkdir(statedir)
+            indexfile = os.path.join(statedir, settings.METADATA_INDEX)
+
+        self.docroot = docroot
+        self.indexfile = indexfile
+
+        self.connection = sqlite3.connect(indexfile)
+        self.connection.text_factory = str
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    class DocrootNotFound(Exception):
+        def __init__(self, value):
+            self.value = value
+
+        def __str__(self):
+            return repr(self.value)
+
+    def _address(self, pagefile):
+        """Return the page address for a page filename.
+
+        The address is the path below the docroot, without the
+        extension. The index page at the top of the docroot has the
+        empty address.
+
+        """
+
+        (basename, ext) = os.path.splitext(pagefile)
+        address = basename[len(self.docroot) + 1:]
+
+        if address == 'index':
+            address = ''
+
+        return address
+
+    def _pagefiles(self):
+        """Generate the filenames of every page in the archive.
+
+        Hidden and temporary files are skipped, as are the meta
+        directories, which hold no pages. If the archive has a
+        webnote.manifest.Manifest, the pages are read from that,
+        rather than by walking the archive.
+
+        """
+
+        skip = [d.strip('/') for d in settings.META]
+
+        # Imported here, as the manifest brings webnote.derivatives,
+        # and with it the job queue, which a query doesn't need.
+        from manifest import Manifest
+
+        manifest = Manifest.load(self.docroot)
+        if manifest:
+            try:
+                for filename in manifest.files('page', skip=skip):
+                    yield filename
+            finally:
+                manifest.close()
+            return
+
+        for directory in Directory.walk(
+                self.docroot, prune=lambda dirpath, name: name in skip):
+            for fname in directory.model['page']:
+                yield os.path.join(directory.dirpath, fname)
+
+    def _split(self, values, separators):
+        """Split a list of metadata values into single, stripped terms."""
+
+        terms = []
+        for value in values:
+            for separator in separators[1:]:
+                value = value.replace(separator, separators[0])
+            for term in value.split(separators[0]):
+                term = term.strip()
+                if term and term not in terms:
+                    terms.append(term)
+
+        return terms
+
+    def close(self):
+        self.connection.close()
+
+    def discard(self, pagefile, commit=True):
+        """Remove a page from the index, given its filename."""
+
+        self.remove(self._address(pagefile), commit)
+
+    def query(self, creator=None, subject=None, doctype=None, status=None,
+              date_from=None, date_to=None):
+        """Return a list of addresses of pages matching all the criteria.
+
+        Creator, subject, type and status match whole values, ignoring
+        case. Dates are compared as strings, so an ISO date like
+        '2017-08-26' or a prefix like '2017' will do. Both ends of the
+        date range are inclusive.
+
+        Results are ordered by date, then address.
+
+        """
+
+        sql = "SELECT address FROM pages WHERE 1"
+        values = []
+
+        if creator:
+            sql += (" AND address IN"
+                    " (SELECT address FROM creators WHERE creator = ?)")
+            values.append(creator)
+
+        if subject:
+            sql += (" AND address IN"
+                    " (SELECT address FROM subjects WHERE subject = ?)")
+            values.append(subject)
+
+        if doctype:
+            sql += " AND doctype = ?"
+            values.append(doctype)
+
+        if status:
+            sql += " AND status = ?"
+            values.append(status)
+
+        if date_from:
+            sql += " AND date >= ?"
+            values.append(date_from)
+
+        if date_to:
+            sql += " AND date <= ? || '~'"
+            values.append(date_to)
+
+        sql += " ORDER BY date, address"
+
+        return [row[0] for row in self.connection.execute(sql, values)]
+
+    def record(self, address):
+        """Return a dictionary of the indexed values for one page."""
+
+        cursor = self.connection.execute(
+            "SELECT address, pagefile, metafile, title, date, doctype, status"
+            " FROM pages WHERE address = ?", (address, ))
+        row = cursor.fetchone()
+
+        if not row:
+            return None
+
+        record = dict(zip(
+            ('address', 'pagefile', 'metafile', 'title', 'date',
+             'doctype', 'status'), row))
+
+        record['creators'] = [r[0] for r in self.connection.execute(
+            "SELECT creator FROM creators WHERE address = ?", (address, ))]
+        record['subjects'] = [r[0] for r in self.connection.execute(
+            "SELECT subject FROM subjects WHERE address = ?", (address, ))]
+
+        return record
+
+    def refresh(self):
+        """Bring the index up to date with the archive.
+
+        Walk the archive for page files. Only pages whose file or
+        metafile has changed since the last refresh are read. Rows for
+        pages which no longer exist are removed.
+
+        Return the number of pages (re)indexed.
+
+        """
+
+        known = {}
+        for row in self.connection.execute(
+                "SELECT address, pagemtime, metafile, metamtime FROM pages"):
+            known[row[0]] = row[1:]
+
+        count = 0
+        for pagefile in self._pagefiles():
+            address = self._address(pagefile)
+            if self.update(pagefile, known.pop(address, None), commit=False):
+                count += 1
+
+        for address in known:
+            self.remove(address, commit=False)
+
+        self.connection.commit()
+
+        return count
+
+    def remove(self, address, commit=True):
+        """Remove a page from the index."""
+
+        for table in ('pages', 'creators', 'subjects'):
+            self.connection.execute(
+                "DELETE FROM " + table + " WHERE address = ?", (address, ))
+
+        if commit:
+            self.connection.commit()
+
+    def update(self, pagefile, known=None, commit=True):
+        """Index a single page, if it has changed.
+
+        The known argument is the (pagemtime, metafile, metamtime)
+        tuple stored for this page, if there is one. Return True if
+        the page was (re)indexed.
+
+        """
+
+        address = self._address(pagefile)
+        metadata = Metadata()
+        metadata.pagefile = pagefile
+        metafile = metadata.locate_metafile()
+
+        pagemtime = os.path.getmtime(pagefile)
+        metamtime = None
+        if metafile:
+            metamtime = os.path.getmtime(metafile)
+
+        if known == (pagemtime, metafile, metamtime):
+            return False
+
+        metadata = Metadata(pagefile)
+
+        self.remove(address, commit=False)
+        self.connection.execute(
+            "INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (address, pagefile, pagemtime, metafile, metamtime,
+             metadata.title(), metadata.pubdate(), metadata.doctype(),
+             '; '.join(metadata.metadata['status'])))
+
+        for creator in self._split(metadata.metadata['dc_creator'], ';'):
+            self.connection.execute(
+                "INSERT INTO creators VALUES (?, ?)", (address, creator))
+
+        for subject in self._split(metadata.metadata['dc_subject'], ',;'):
+            self.connection.execute(
+                "INSERT INTO subjects VALUES (?, ?)", (address, subject))
+
+        if commit:
+            self.connection.commit()
+
+        return True
@@ -1,18 +1,21 @@
 """Classes interpreting the simple filesystem syntax.
 """
 
+import datetime
+import hashlib
 import os
-
-from bs4 import BeautifulSoup
-import html2text
-import markdown2 as markdown
 import re
-import smartypants
+import sys
 
+import derivatives
 from directory import Directory
 from gallery import Gallery
+from jobs import JobQueue
 from metadata import Metadata
 import settings
+from summary import PageSummary
+import timing
+import utils
 from webnote import Webnote
 
 
@@ -93,8 +96,27 @@ class Page(Webnote):
     _unref_figs = None
     _store_documents = None
     _store_heading_index = None
+    _context = None
+
+    # (filename, sha256 digest, size) tuples for files saved by save().
+    uploaded = None
+
+    # Ids of the webnote.jobs jobs queued by save().
+    jobs = None
+
+    warnings = None
+
+    # A webnote.timing.Timings of the phases run building and rendering
+    # this page, when timing is on.
+    timings = None
 
-    warnings = []
+    # Used by novel() to join and demote the children.
+    NOVEL_SEPARATOR = "\n\n<!-- ------------------- -->\n"
+    H1_TAG = re.compile(r'(</?)h1(?=[\s/>])', re.IGNORECASE)
+    ENTITY = re.compile(r'&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+
+    # Characters which stay escaped, as BeautifulSoup leaves them.
+    ESCAPED = (ord('"'), ord('&'), ord('<'), ord('>'))
 
     def __init__(self, docroot, baseurl, address=None,
                  data=None, staticroot=None):
@@ -132,6 +154,9 @@ class Page(Webnote):
 
         self.warnings = []
 
+        if timing.enabled():
+            self.timings = timing.Timings()
+
         self.address = address
         self.baseurl = baseurl
         self.data = data
@@ -140,41 +165,9 @@ class Page(Webnote):
         if docroot[-1] != '/':
             self.docroot = docroot + '/'
 
-        if address:
-            (self.paired_dirname,
-             self.parent_dirname) = self._find_directories()
-            if address[-1] == '/':
-                self.address = address[:-1]
-
-        else:
-            self.paired_dirname = docroot
-            self.parent_dirname = docroot
-
-        if staticroot:
-            self.staticroot = staticroot
-        else:
-            self.staticroot = settings.STATIC_URL
-
-        (self.parent_directory,
-         self.paired) = self._parse_directories()
-
-        self.filename = self._find_filename(docroot, address)
-        self.filecontent = self._read_target_file(self.filename)
-
-        self.link = self._get_link()
-
-        self.metadata = Metadata(self.filename, data)
-        self.parent = self._find_parent()
-
-        if len(self.metadata.pagetype()) > 0:
-            if self.metadata.pagetype()[0] == 'gallery':
-
-                try:
-                    self.gallery = Gallery(
-                        docroot=docroot, baseurl=baseurl, address=address,
-                    )
-                except Gallery.DirectoryNotFound:
-                    self.gallery = None
+        with timing.collect(self.timings), \
+                timing.phase('page.init', address):
+            self._build(docroot, baseurl, address, data, staticroot)
 
     class DocrootNotFound(Exception):
         def __init__(self, value):
@@ -365,10 +358,41 @@ class Page(Webnote):
 
         return ''
 
-    def breadcrumbs(self):
-        """A list of (link, text) tuples climbing back up the hierachy.
+    def _adjacent(self, step):
+        """Return a (link, text) tuple for the sibling step places away.
 
-        Start with the baseurl, then explode the address by slashes."""
+        Positions come from the parent directory's ordered sibling
+        table, so this costs the same in a directory of thousands of
+        pages as it does in a directory of three. Return (None, None)
+        if there is no such sibling.
+
+        """
+
+        if not self.parent_directory:
+            return (None, None)
+
+        (pages, positions) = self._sibling_order()
+
+        fname = ''
+        if self.filename:
+            fname = os.path.basename(self.filename)
+
+        n = positions.get(fname)
+        if n is None or not 0 <= n + step < len(pages):
+            return (None, None)
+
+        address = ''
+        if self.address:
+            address = self.address
+        (path, basename) = os.path.split(address)
+
+        (basename, ext) = os.path.splitext(pages[n + step])
+        link = os.path.join(self.baseurl, path, basename)
+
+        return (link, basename)
+
+    def _breadcrumbs(self, previous, nextpage):
+        """Return breadcrumbs(), given the previous and next links."""
 
         link = self.baseurl
         text = self.baseurl
@@ -380,44 +404,304 @@ class Page(Webnote):
                 link = os.path.join(link, item)
                 crumbs.append((link, item.replace('_', ' ')))
 
-        crumbs.append((self.previous()[0], 'prev'))
-        crumbs.append((self.nextpage()[0], 'next'))
+        crumbs.append((previous[0], 'prev'))
+        crumbs.append((nextpage[0], 'next'))
 
         return crumbs
 
-    def children(self):
-        """Return a list of page objects comprising this page's children.
+    def _build(self, docroot, baseurl, address, data, staticroot):
+        """Find the files and directories of the page, as __init__ says.
+
+        Each step is a phase for webnote.timing.
+
         """
 
-        if not self.paired:
-            return None
+        if address:
+            (self.paired_dirname,
+             self.parent_dirname) = self._find_directories()
+            if address[-1] == '/':
+                self.address = address[:-1]
 
-        address = ''
-        if self.address:
-            address = self.address
+        else:
+            self.paired_dirname = docroot
+            self.parent_dirname = docroot
 
-        filename = ''
-        if self.filename:
-            filename = self.filename
+        if staticroot:
+            self.staticroot = staticroot
+        else:
+            self.staticroot = settings.STATIC_URL
 
-        (path, fname) = os.path.split(filename)
+        with timing.phase('page.directories', address):
+            (self.parent_directory,
+             self.paired) = self._parse_directories()
 
-        children = []
+        with timing.phase('page.file', address):
+            self.filename = self._find_filename(docroot, address)
+            self.filecontent = self._read_target_file(self.filename)
+
+        self.link = self._get_link()
+
+        with timing.phase('page.metadata', address):
+            self.metadata = Metadata(
+                self.filename, data, directory=self.parent_directory)
+
+        with timing.phase('page.parent', address):
+            self.parent = self._find_parent()
+
+        if len(self.metadata.pagetype()) > 0:
+            if self.metadata.pagetype()[0] == 'gallery':
+
+                try:
+                    with timing.phase('page.gallery', address):
+                        self.gallery = Gallery(
+                            docroot=docroot, baseurl=baseurl,
+                            address=address,
+                        )
+                except Gallery.DirectoryNotFound:
+                    self.gallery = None
+
+    def _child_pages(self):
+        """Return a list of (filename, address) tuples for the children.
+
+        Children are the page files in the paired directory, other
+        than an index, in the order given by the sort command.
+
+        """
+
+        address = ''
+        if self.address:
+            address = self.address
 
-        child_pages = self.paired.model['page']
 #       Handle the sort reverse command.
-        if len(self.metadata.metadata['sort']):
-            if self.metadata.metadata['sort'][0] == 'reverse':
-                child_pages = sorted(child_pages, reverse=True)
+        (child_pages, positions) = self.paired.page_order(
+            self.metadata.sort_reverse())
 
+        children = []
         for page in child_pages:
             (basename, ext) = os.path.splitext(page)
-            if basename.lower() == 'index':
-                pass
+            if basename.lower() != 'index':
+                children.append((page, os.path.join(address, basename)))
+
+        return children
+
+    def _decode_entity(self, match):
+
+        # Imported here, as only the novel needs it.
+        import htmlentitydefs
+
+        name = match.group(1)
+        if name[:2] in ('#x', '#X'):
+            codepoint = int(name[2:], 16)
+        elif name[0] == '#':
+            codepoint = int(name[1:])
+        else:
+            codepoint = htmlentitydefs.name2codepoint.get(name)
+
+        if codepoint is None or codepoint in self.ESCAPED or \
+                codepoint > sys.maxunicode:
+            return match.group(0)
+
+        if isinstance(match.string, unicode):
+            return unichr(codepoint)
+
+        return unichr(codepoint).encode('utf-8')
+
+    def _demote(self, content):
+        """Step the H1 headings in an HTML string down to H2.
+
+        Character references, such as the curly quotes of smartypants,
+        are written as UTF-8 characters, as they were when the children
+        were put through BeautifulSoup. Those for &, <, > and " stay.
+
+        """
+
+        content = self.ENTITY.sub(self._decode_entity, content)
+
+        return self.H1_TAG.sub(r'\1h2', content)
+
+    def _render_children(self, workers=None):
+        """Generate a rendering dictionary for each child, in order.
+
+        See render_children(). Results are yielded as they arrive,
+        which is always in the order of the children.
+
+        """
+
+        jobs = []
+        for (page, address) in self._child_pages():
+            jobs.append(
+                (self.docroot, self.baseurl, address, self.staticroot))
+
+        # Imported here, as only rendering in parallel needs it.
+        import multiprocessing
+
+        if not workers:
+            workers = settings.RENDER_WORKERS
+        if not workers:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(jobs))
+
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                for child in pool.imap(_render, jobs):
+                    yield child
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+
+        else:
+            for job in jobs:
+                yield _render(job)
+
+    def _render_content(self):
+        """Render the page file as HTML, for content().
+
+        Each step is a phase for webnote.timing.
+
+        """
+
+        # Imported here, so that loading this module, for the cheap
+        # parts of a Page, doesn't load the renderers.
+        from bs4 import BeautifulSoup
+        import markdown2 as markdown
+
+        content = self.filecontent
+        if not content:
+            content = ''
+
+        (basename, ext) = os.path.splitext(self.filename)
+
+        source = content
+
+        baseurl = self.baseurl
+        if baseurl[0] == '/':
+            baseurl = self.baseurl[1:]
+
+        baseurl = os.path.join(self.staticroot, baseurl)
+        if self.address:
+            baseurl = os.path.join(self.staticroot, baseurl, self.address)
+
+        figures = None
+
+        if self.paired:
+            figures = self.paired.model['figures']
+            directory = None
+
+        if ext in settings.SUFFIX['html']:
+            content = self.filecontent
+        else:
+            if figures:
+                with timing.phase('content.reference_figures', self.address):
+                    (content, unref_figs) = self.reference_figures(
+                        source, baseurl, figures=figures
+                    )
+                self._unref_figs = unref_figs
             else:
-                addr = os.path.join(address, basename)
-                p = Page(self.docroot, self.baseurl, addr)
-                children.append(p)
+                content = self.filecontent
+
+            if content:
+                with timing.phase('content.markdown', self.address):
+                    content = markdown.markdown(content)
+
+        with timing.phase('content.soup', self.address):
+            # Find the H1 line in the content string
+            soup = BeautifulSoup(content, "html.parser")
+            h1 = soup.find_all('h1')
+            # If it's not there, insert one created from the filename.
+            if not len(h1):
+                h1 = "<h1 class='noprint'>"
+                h1 += self.title_from_fname().replace('_', ' ')
+                h1 += "</h1>\n\n"
+                content = h1 + content
+
+            # Compile a headings index.
+            heading_index = None
+            headings = soup.find_all(['h2', 'h3', 'h4'])
+            if len(headings) > 0:
+                heading_index = []
+                count2 = 0
+                count3 = 0
+                count4 = 0
+
+                for h in headings:
+                    if h.name == 'h2':
+                        count2 +=1
+                        link = h.name + '-' + str(count2)
+                    elif h.name == 'h3':
+                        count3 +=1
+                        link = h.name + '-' + str(count3)
+                    elif h.name == 'h4':
+                        count4 +=1
+                        link = h.name + '-' + str(count4)
+
+                    for f in h.descendants:
+                        text = f
+
+                    heading_index.append((link, text))
+                    h['id'] = link
+
+                self._store_heading_index = heading_index
+
+            content = str(soup)
+
+        with timing.phase('content.smartypants', self.address):
+            content = self.replacements(content)
+
+        return content
+
+    def _sibling_order(self):
+        """Return (pages, positions) for the pages in the parent directory.
+
+        The order honours the sort command of the parent page. See
+        webnote.Directory.page_order().
+
+        """
+
+        reverse = False
+        if self.parent:
+            reverse = self.parent.metadata.sort_reverse()
+
+        return self.parent_directory.page_order(reverse)
+
+    def breadcrumbs(self):
+        """A list of (link, text) tuples climbing back up the hierachy.
+
+        Start with the baseurl, then explode the address by slashes."""
+
+        return self._breadcrumbs(self.previous(), self.nextpage())
+
+    def children(self):
+        """Return a list of page objects comprising this page's children.
+        """
+
+        if not self.paired:
+            return None
+
+        children = []
+        for (page, address) in self._child_pages():
+            children.append(Page(self.docroot, self.baseurl, address))
+
+        return children
+
+    def children_summaries(self):
+        """Return a list of PageSummary objects for this page's children.
+
+        This is the cheap alternative to children(), for listing
+        children with their titles, dates and thumbnails.
+
+        """
+
+        if not self.paired:
+            return None
+
+        children = []
+        for (page, address) in self._child_pages():
+            children.append(PageSummary(
+                self.paired, page, address, self.baseurl,
+                staticroot=self.staticroot,
+            ))
 
         return children
 
@@ -454,6 +738,8 @@ class Page(Webnote):
     def concordance(self):
         """List words and word counts, in a table."""
 
+        import html2text
+
         concordance = {}
 
         h = html2text.HTML2Text()
@@ -527,114 +813,65 @@ class Page(Webnote):
         if self._store_content:
             return self._store_content
 
-        content = self.filecontent
-        if not content:
-            content = ''
-
-        (basename, ext) = os.path.splitext(self.filename)
-
-        source = content
+        with timing.collect(self.timings), \
+                timing.phase('page.content', self.address):
+            self._store_content = self._render_content()
 
-        baseurl = self.baseurl
-        if baseurl[0] == '/':
-            baseurl = self.baseurl[1:]
+        return self._store_content
 
-        baseurl = os.path.join(self.staticroot, baseurl)
-        if self.address:
-            baseurl = os.path.join(self.staticroot, baseurl, self.address)
+    def content_novel(self, workers=None):
+        """Stitch all the children together into a single document.
 
-        figures = None
+        Move the H1 headings of the children down a level, so H1
+        becomes H2. This joins the chunks from novel().
 
-        if self.paired:
-            figures = self.paired.model['figures']
-            directory = None
-
-        if ext in settings.SUFFIX['html']:
-            content = self.filecontent
-        else:
-            if figures:
-                (content, unref_figs) = self.reference_figures(
-                    source, baseurl, figures=figures
-                )
-                self._unref_figs = unref_figs
-            else:
-                content = self.filecontent
+        """
 
-            if content:
-                content = markdown.markdown(content)
-
-        # Find the H1 line in the content string
-        soup = BeautifulSoup(content, "html.parser")
-        h1 = soup.find_all('h1')
-        # If it's not there, insert one created from the filename.
-        if not len(h1):
-            h1 = "<h1 class='noprint'>"
-            h1 += self.title_from_fname().replace('_', ' ')
-            h1 += "</h1>\n\n"
-            content = h1 + content
-
-        # Compile a headings index.
-        heading_index = None
-        headings = soup.find_all(['h2', 'h3', 'h4'])
-        if len(headings) > 0:
-            heading_index = []
-            count2 = 0
-            count3 = 0
-            count4 = 0
-
-            for h in headings:
-                if h.name == 'h2':
-                    count2 +=1
-                    link = h.name + '-' + str(count2)
-                elif h.name == 'h3':
-                    count3 +=1
-                    link = h.name + '-' + str(count3)
-                elif h.name == 'h4':
-                    count4 +=1
-                    link = h.name + '-' + str(count4)
-
-                for f in h.descendants:
-                    text = f
-
-                heading_index.append((link, text))
-                h['id'] = link
-
-            self._store_heading_index = heading_index
-
-        content = str(soup)
-
-        content = self.replacements(content)
-
-        self._store_content = content
+        return ''.join(self.novel(workers))
 
-        return self._store_content
+    def context(self):
+        """Return a dictionary of everything a page template needs.
 
-    def content_novel(self):
-        """Stitch all the siblings together into a single document.
+        Templates otherwise call breadcrumbs(), previous(), nextpage(),
+        sibling_links(), child_links(), thumbnail(), title() and
+        heading_index() one by one, and several of them redo each
+        other's work. This computes each once, sharing the previous
+        and next links between breadcrumbs and the page navigation,
+        and renders the content, which the heading index and the
+        unreferenced figures come from, once.
 
-        Move all the headings one level down, so H1 becomes H2 and so on.
+        The keys are page, title, content, heading_index, unref_figs,
+        breadcrumbs, previous, nextpage, parent_link, sibling_links,
+        child_links, thumbnail and metadata, holding what the methods
+        of those names return. The dictionary is kept on the Page, and
+        made again after save().
 
         """
 
-        body = ''
-
-        # Stitch content for all the children together into one string.
-        for child in self.children():
-            body += "\n\n<!-- ------------------- -->\n" + child.content()
-
-        # Step all the headings down a level.
-        soup = BeautifulSoup(body, "html.parser")
-        h1 = soup.find_all('h1')
-        for i in h1:
-            #print i
-            i.name = 'h2'
+        if self._context is not None:
+            return self._context
 
+        previous = self.previous()
+        nextpage = self.nextpage()
+        content = self.content()
 
-        body = str(soup)
-        
-        content = self.content() + body
-
-        return content
+        self._context = {
+            'page': self,
+            'title': self.title(),
+            'content': content,
+            'heading_index': self._store_heading_index,
+            'unref_figs': self.unref_figs(),
+            'breadcrumbs': self._breadcrumbs(previous, nextpage),
+            'previous': previous,
+            'nextpage': nextpage,
+            'parent_link': self.parent_link(),
+            'sibling_links': self.sibling_links(),
+            'child_links': self.child_links(),
+            'thumbnail': self.thumbnail(),
+            'metadata': self.metadata,
+        }
+
+        return self._context
 
     def documents(self):
         """Return a list of the documents in the paired directory. """
@@ -670,41 +907,30 @@ class Page(Webnote):
         return self._store_heading_index
 
     def nextpage(self):
+        """Return a (link, text) tuple for the next page in the series."""
 
-        address = ''
-        if self.address:
-            address = self.address
-        filename = ''
-        if self.filename:
-            filename = self.filename
+        return self._adjacent(1)
 
-        link = ''
-        n = 0
-        siblings = self.parent_directory.model['page']
-        text = "The previous page has no name"
+    def novel(self, workers=None):
+        """Generate the content of this page and all its children.
 
-        (path, fname) = os.path.split(filename)
-        if fname in siblings:
-            n = siblings.index(fname)
+        Yield the content of this page, then the content of each child
+        in turn, with its H1 headings stepped down to H2. Headings are
+        demoted chunk by chunk, so the whole document is never held in
+        memory at once. Hand this to a streaming response, or see
+        write_novel().
 
-        path, basename = os.path.split(address)
+        Children are rendered as in render_children().
 
-        if n == len(siblings)-1:
-            link = None
-            text = None
+        """
 
-        else:
-            try:
-                (basename, ext) = os.path.splitext(siblings[n+1])
-                link = os.path.join(self.baseurl, path, basename)
-                text = basename
-            except IndexError:
-                link = None
-                text = None
+        yield self.content()
 
-        nextpage = (link, text)
+        if not self.paired:
+            return
 
-        return nextpage
+        for child in self._render_children(workers):
+            yield self.NOVEL_SEPARATOR + self._demote(child['content'])
 
     def parent_link(self):
         """Compute a (link, text) tuble identifying the parent
@@ -737,46 +963,39 @@ class Page(Webnote):
         return (link, text)
 
     def previous(self):
+        """Return a (link, text) tuple for the previous page in the series."""
 
-        address = ''
-        if self.address:
-            address = self.address
+        return self._adjacent(-1)
 
-        filename = ''
-        if self.filename:
-            filename = self.filename
+    def render_children(self, workers=None):
+        """Render all the children, and return a list of dictionaries.
 
-        link = ''
-        n = 0
-        siblings = self.parent_directory.model['page']
-        text = "The previous page has no name"
+        Each dictionary holds the address, link, title, content,
+        heading_index and unref_figs of one child, as computed by the
+        child's own Page methods. The list is in the order given by
+        the sort command.
 
-        (path, fname) = os.path.split(filename)
-        if fname in siblings:
-            n = siblings.index(fname)
-
-        path, basename = os.path.split(address)
-
-        if n == 0:
-            link = None
-            text = None
+        Rendering is CPU bound, so the children are shared among a
+        pool of worker processes, workers of them, defaulting to
+        settings.RENDER_WORKERS, or one for each CPU. With one worker,
+        or only one child, they are rendered here, one at a time.
 
-        else:
-            (basename, ext) = os.path.splitext(siblings[n-1])
-            link = os.path.join(self.baseurl, path, basename)
-            text = basename
+        """
 
-        previous = (link, text)
+        if not self.paired:
+            return None
 
-        return previous
+        return list(self._render_children(workers))
 
     def replacements(self, content):
         """Replace quote characters and the like.
         """
 
+        import smartypants
+
         return smartypants.smartypants(content)
 
-    def save(self, data, files=None):
+    def save(self, data, files=None, lock=False):
         """Replace the contents of the file with the supplied data.
 
         Call the metadata object and update or create a metafile with
@@ -788,6 +1007,24 @@ class Page(Webnote):
             'dc_title': dc_title,
             ...
 
+        Files are replaced atomically, so a reader never sees a
+        part-written page. Set lock to hold advisory locks while
+        writing, for concurrent editors. Caches registered with
+        webnote.utils.add_invalidation_hook() are told about every
+        file written.
+
+        An uploaded file, in files['filename'], is streamed to a
+        temporary file and renamed into place. It is hashed on the
+        way, and refused with webnote.utils.FileTooLarge if it is
+        bigger than settings.UPLOAD_MAX_SIZE. Its filename, digest and
+        size are recorded in the uploaded attribute. Thumbnails and
+        summaries of pictures and GPX files are made afterwards, in the
+        background. See webnote.derivatives.
+
+        The ids of jobs queued for workers, for the derivatives and to
+        bring the metadata index up to date, are added to the jobs
+        attribute, to be polled with webnote.jobs.JobQueue.status().
+
         Return True if everything goes according to plan.
 
         """
@@ -796,6 +1033,9 @@ class Page(Webnote):
         if address == 'index':
             address = ''
 
+        if self.jobs is None:
+            self.jobs = []
+
         filename = self.filename
 
         if 'newfilename' in data.keys():
@@ -807,24 +1047,50 @@ class Page(Webnote):
 
         if 'content' in data.keys():
             filecontent = data['content']
-            f = open(filename, 'w')
-            f.write(filecontent)
+            utils.atomic_write(filename, filecontent, lock=lock)
             self.filename = filename
+            self.filecontent = filecontent
+            utils.invalidate(filename)
 
         if not self.paired:
             path = os.path.join(self.docroot, self.address)
             os.mkdir(path)
+            utils.invalidate(path)
 
         if files:
             f = files['filename']
             filepath = os.path.join(
                 self.docroot, self.address, str(files['filename']))
 
-            with open(filepath, 'wb+') as destination:
-                for chunk in f.chunks():
-                    destination.write(chunk)
+            (digest, size) = utils.atomic_stream(
+                f.chunks(), filepath,
+                max_size=settings.UPLOAD_MAX_SIZE, lock=lock,
+            )
+            utils.invalidate(filepath)
+
+            if self.uploaded is None:
+                self.uploaded = []
+            self.uploaded.append((filepath, digest, size))
+
+            job = derivatives.enqueue(filepath, self.docroot, digest)
+            if job is not True and job:
+                self.jobs.append(job)
 
-        self.metadata.save(data)
+        self.metadata.save(data, lock=lock)
+
+#       Whatever was saved, content, metadata or uploads, what was
+#       rendered before is out of date.
+        self._store_content = None
+        self._store_heading_index = None
+        self._unref_figs = None
+        self._context = None
+
+        if settings.BACKGROUND_JOBS:
+            queue = JobQueue(self.docroot)
+            try:
+                self.jobs.append(queue.enqueue('index'))
+            finally:
+                queue.close()
 
         return True
 
@@ -843,11 +1109,7 @@ class Page(Webnote):
         siblings = []
         steps = self.address.split('/')
 
-        pages = self.parent_directory.model['page']
-
-        if self.parent.metadata.metadata['sort']:
-            if self.parent.metadata.metadata['sort'][0] == 'reverse':
-                pages = sorted(pages, reverse=True)
+        (pages, positions) = self._sibling_order()
 
         for page in pages:
             (basename, ext) = os.path.splitext(page)
@@ -888,10 +1150,7 @@ class Page(Webnote):
 
         (path, fname) = os.path.split(filename)
 
-        pages = self.parent_directory.model['page']
-
-        if self.parent.metadata.metadata['sort']:
-            pages = sorted(pages, reverse=True)
+        (pages, positions) = self._sibling_order()
 
         for page in pages:
             (basename, ext) = os.path.splitext(page)
@@ -909,6 +1168,30 @@ class Page(Webnote):
 
         return sibs
 
+    def sibling_summaries(self):
+        """Return a list of PageSummary objects for this page's siblings.
+
+        This is the cheap alternative to siblings().
+
+        """
+
+        if not self.address or not self.parent_directory:
+            return None
+
+        (path, fname) = os.path.split(self.address)
+        (pages, positions) = self._sibling_order()
+
+        siblings = []
+        for page in pages:
+            (basename, ext) = os.path.splitext(page)
+            if basename != fname:
+                siblings.append(PageSummary(
+                    self.parent_directory, page, os.path.join(path, basename),
+                    self.baseurl, staticroot=self.staticroot,
+                ))
+
+        return siblings
+
     def thumbnail(self):
         """Return a (src, alt) tuple for the page'sthumbnail file."""
 
@@ -989,6 +1272,85 @@ class Page(Webnote):
         content = self.content()
         return self._unref_figs
 
+    @classmethod
+    def validators(cls, docroot, address=None):
+        """Return (etag, last_modified) for a page, without building it.
+
+        For conditional GETs. The page is not built or rendered, and
+        no file is read: a handful of stats find the page file and its
+        metafile, and look at the parent and paired directories, and
+        the meta directories in each. Their mtimes, sizes and inodes
+        make a strong ETag, quoted ready for the header. last_modified
+        is the latest of the mtimes, as a naive UTC datetime.
+
+        A file added, removed or renamed in the directories changes
+        their mtimes, and so the ETag. So does a metafile saved with
+        webnote, which writes through a rename. A sibling's metafile
+        edited in place, which changes its title in the sibling links,
+        is not seen.
+
+        Return (None, None) if there is no page file at address.
+
+        """
+
+        address = (address or '').strip('/')
+
+        if address in ('', 'index'):
+            basename = os.path.join(docroot, 'index')
+            paired = docroot
+        else:
+            basename = os.path.join(docroot, address)
+            paired = basename
+
+        (parent, last) = os.path.split(basename)
+
+        stats = []
+        for suffix in settings.SUFFIX['page']:
+            stat = _stat(basename + suffix)
+            if stat:
+                stats.append((basename + suffix, stat))
+                break
+
+        if not stats:
+            return (None, None)
+
+        # The metafile is looked for as Metadata.locate_metafile()
+        # does, so one appearing ahead of the current one is noticed.
+        metadir = os.path.join(parent, settings.META[0])
+        for metafile in (basename + '.meta',
+                         os.path.join(metadir, last + '.meta'),
+                         os.path.join(basename, last + '.meta')):
+            stat = _stat(metafile)
+            if stat:
+                stats.append((metafile, stat))
+                break
+
+        dirpaths = [parent, metadir]
+        if paired != parent:
+            dirpaths += [paired, os.path.join(paired, settings.META[0])]
+
+        for dirpath in dirpaths:
+            stats.append((dirpath, _stat(dirpath)))
+
+        signature = []
+        for (path, stat) in stats:
+            if stat:
+                signature.append(
+                    (path, stat.st_mtime, stat.st_size, stat.st_ino))
+            else:
+                signature.append((path, None))
+
+        etag = '"' + hashlib.sha1(repr(signature)).hexdigest() + '"'
+        mtime = max(stat.st_mtime for (path, stat) in stats if stat)
+
+        return (etag, datetime.datetime.utcfromtimestamp(int(mtime)))
+
+    def write_novel(self, f, workers=None):
+        """Write the novel to the open file f, a chunk at a time."""
+
+        for chunk in self.novel(workers):
+            f.write(chunk)
+
     def wordcount(self):
         """Return the number of words in a text file."""
 
@@ -996,3 +1358,42 @@ class Page(Webnote):
             return 0
 
         return len(self.filecontent.split())
+
+
+def _render(job):
+    """Render the page at a (docroot, baseurl, address, staticroot) tuple.
+
+    Return a dictionary of the rendered values, as described in
+    Page.render_children(). This is a module function, rather than a
+    method, so that it can be handed to a pool of worker processes.
+    Everything in the dictionary is a plain string, list or tuple, so
+    it is cheap to send back from a worker.
+
+    """
+
+    (docroot, baseurl, address, staticroot) = job
+    page = Page(docroot, baseurl, address, staticroot=staticroot)
+
+    heading_index = None
+    if page.heading_index():
+        heading_index = [
+            (link, unicode(text)) for (link, text) in page.heading_index()
+        ]
+
+    return {
+        'address': address,
+        'link': page.link,
+        'title': page.title(),
+        'content': page.content(),
+        'heading_index': heading_index,
+        'unref_figs': page.unref_figs(),
+    }
+
+
+def _stat(path):
+    """Return os.stat() of path, or None if there is nothing there."""
+
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
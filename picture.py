@@ -2,17 +2,16 @@
 """
 
 import datetime
-import exifread
 import os
-import pytz
-
-from PIL import Image
+import threading
 
 from directory import Directory
 from metadata import Metadata
 from webnote import Webnote
 
 import settings
+import timing
+import utils
 
 
 class Picture():
@@ -33,8 +32,13 @@ class Picture():
     exif_store = None
 
     def __init__(self, filename, docroot=None, baseurl=None,
-                 data=None, staticroot=None):
-        """
+                 data=None, staticroot=None, parent=None):
+        """Open a picture file.
+
+        parent is the webnote.directory.Directory of the directory the
+        picture is in. A gallery making many pictures passes its own,
+        so that the directory isn't listed again for each picture.
+
         """
 
         if not os.path.isfile(filename):
@@ -45,9 +49,12 @@ class Picture():
         self.docroot = docroot
         self.baseurl = baseurl
 
-        self.parent = Directory(
-            self.parentpath, docroot=docroot, baseurl=baseurl
-        )
+        if parent is None:
+            parent = Directory(
+                self.parentpath, docroot=docroot, baseurl=baseurl
+            )
+
+        self.parent = parent
 
         if not staticroot:
             staticroot = settings.STATIC_URL
@@ -55,6 +62,10 @@ class Picture():
         self.staticroot = staticroot
         self.data = data
 
+        # PIL, exifread and pytz are imported where they are used, so
+        # that loading this module doesn't load them.
+        from PIL import Image
+
         self.img = Image.open(filename)
 
     class FileNotFound(Exception):
@@ -122,6 +133,8 @@ class Picture():
             gpsdate = self.read_exif()['GPS GPSDate']
             gpstime = self.read_exif()['GPS GPSTimeStamp']
 
+            import pytz
+
             UTC = pytz.timezone('UTC')
             (Y, M, D) = gpsdate.values.split(':')
 
@@ -222,7 +235,51 @@ class Picture():
         return self.parent.model['gpx']
 
     def make_thumbnails(self):
-        """Create thumbnail copies at 512 and 1024 pix."""
+        """Create thumbnail copies at 512 and 1024 pix.
+
+        The copies go in the directories named by d512() and d1024(),
+        which are created if they don't exist. Return a list of the
+        filenames written.
+
+        With a docroot, the copies are made by the archive's
+        webnote.hashstore.HashStore, and shared with identical
+        pictures. Without one, each copy is written to a temporary
+        file and renamed into place. Either way, a copy hard linked
+        with the store is replaced, not written through.
+
+        """
+
+        if self.docroot:
+            # Imported here, as webnote.hashstore imports this module.
+            from hashstore import HashStore
+
+            store = HashStore(self.docroot)
+            try:
+                store.derivatives(self.filename)
+            finally:
+                store.close()
+
+            return [self.fname1024(), self.fname512()]
+
+        for d in (self.d1024(), self.d512()):
+            if not os.path.isdir(d):
+                os.mkdir(d)
+
+        img = self.img.copy()
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        for (pixels, target) in ((1024, self.fname1024()),
+                                 (512, self.fname512())):
+            img.thumbnail((pixels, pixels))
+            tempname = os.path.join(os.path.dirname(target), '.%s.%d.%d~' % (
+                os.path.basename(target), os.getpid(),
+                threading.current_thread().ident))
+            img.save(tempname, "jpeg")
+            os.rename(tempname, target)
+            utils.invalidate(target)
+
+        return [self.fname1024(), self.fname512()]
 
     def read_exif(self):
         """Return a dictionary of exif terms and values.
@@ -237,8 +294,11 @@ class Picture():
         if self.exif_store:
             return self.exif_store
 
-        f = open(self.filename, 'rb')
-        self.exif_store = exifread.process_file(f)
+        import exifread
+
+        with timing.phase('picture.read_exif', self.filename):
+            with open(self.filename, 'rb') as f:
+                self.exif_store = exifread.process_file(f)
 
         return self.exif_store
 
@@ -0,0 +1,265 @@
+"""webnote.pictureorder. The pictures of each gallery, in date order.
+
+A gallery shown in the order its pictures were taken needs the EXIF
+date of every one of them before the first can be shown, and reading
+it means opening each file. The PictureOrder keeps the dates in the
+STATE_DIR, so a page of a large gallery is a query of an index, and
+only the pictures on that page are opened.
+
+A gallery is verified by the modification time of its directory, as
+webnote.manifest verifies the archive. While it is unchanged the
+recorded order is used as it is. When it has changed, each picture is
+statted, and only those which are new, or whose size or modification
+time differ from those recorded, are opened for their date.
+
+"""
+
+import datetime
+import os
+import sqlite3
+
+import settings
+import timing
+
+
+class PictureOrder():
+    """The EXIF dates of the pictures of each gallery, kept in sqlite.
+
+    ### Usage
+
+        order = PictureOrder(docroot)
+        names = order.window(directory, offset=0, limit=50)
+        cursor = order.cursor(directory, names[-1])
+        names = order.window(directory, limit=50, after=cursor)
+
+    Pictures are in order of the date taken, and by name among those
+    taken at the same time. Pictures without a date come last, by
+    name.
+
+    A cursor is the date and the name of the last picture of a page,
+    as 'date/name', or '/name' for a picture without a date. Names
+    can't hold a '/', so the two are split at the last one. The next
+    page begins after that place in the order, whether or not the
+    picture is still there. A bare name is taken as a cursor too, if
+    the picture is still in the gallery, and raises CursorNotFound if
+    it isn't.
+
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS galleries (
+            path TEXT PRIMARY KEY,
+            mtime REAL
+        )""",
+        """CREATE TABLE IF NOT EXISTS pictures (
+            gallery TEXT,
+            name TEXT,
+            size INTEGER,
+            mtime REAL,
+            taken TEXT,
+            PRIMARY KEY (gallery, name)
+        )""",
+        """CREATE INDEX IF NOT EXISTS pictures_taken
+            ON pictures (gallery, taken IS NULL, taken, name)""",
+    )
+
+    docroot = None
+    connection = None
+
+    def __init__(self, docroot, dbfile=None):
+        """Open, or create, the picture order of the archive at docroot."""
+
+        if docroot[-1] == '/':
+            docroot = docroot[:-1]
+
+        if not dbfile:
+            statedir = os.path.join(docroot, settings.STATE_DIR)
+            if not os.path.isdir(statedir):
+                try:
+                    os.mkdir(statedir)
+                except OSError:
+                    pass
+            dbfile = os.path.join(statedir, settings.PICTURE_ORDER)
+
+        self.docroot = docroot
+
+        # The order is a cache, which verifying repairs, so commits
+        # need not wait for the disk.
+        self.connection = sqlite3.connect(dbfile, timeout=30)
+        self.connection.text_factory = str
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    class CursorNotFound(Exception):
+        def __init__(self, value):
+            self.value = value
+
+        def __str__(self):
+            return repr(self.value)
+
+    def _relative(self, dirpath):
+        """Return the path below the docroot, '' for the docroot itself."""
+
+        return dirpath[len(self.docroot) + 1:]
+
+    def _taken(self, filename):
+        """Return the EXIF date of a picture as an ISO string, or None.
+
+        Only the first directory of EXIF tags, which holds the date, is
+        read, and not the thumbnail or the maker notes.
+
+        """
+
+        # Imported here, as only a gallery with new pictures needs it.
+        import exifread
+
+        with timing.phase('pictureorder.taken', filename):
+            try:
+                with open(filename, 'rb') as f:
+                    tags = exifread.process_file(
+                        f, stop_tag='DateTime', details=False)
+            except IOError:
+                return None
+
+        if 'Image DateTime' not in tags:
+            return None
+
+        try:
+            taken = datetime.datetime.strptime(
+                str(tags['Image DateTime']).strip(), "%Y:%m:%d %H:%M:%S")
+        except ValueError:
+            return None
+
+        return taken.isoformat()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def cursor(self, directory, name):
+        """Return the cursor of the page ending with the picture name."""
+
+        self.update(directory)
+
+        row = self.connection.execute(
+            "SELECT taken FROM pictures WHERE gallery = ? AND name = ?",
+            (self._relative(directory.dirpath), name)).fetchone()
+
+        if row and row[0]:
+            return row[0] + '/' + name
+
+        return '/' + name
+
+    def update(self, directory):
+        """Verify the recorded order of the pictures of a directory.
+
+        directory is a webnote.directory.Directory. If its modification
+        time is as recorded, nothing more is done. Otherwise the
+        pictures it lists are statted, and the dates of any new or
+        changed ones read. Return True if the record was changed.
+
+        """
+
+        dirpath = directory.dirpath
+        relpath = self._relative(dirpath)
+
+        try:
+            mtime = os.stat(dirpath).st_mtime
+        except OSError:
+            mtime = None
+
+        row = self.connection.execute(
+            "SELECT mtime FROM galleries WHERE path = ?",
+            (relpath, )).fetchone()
+
+        if row and mtime is not None and row[0] == mtime:
+            return False
+
+        known = {}
+        for row in self.connection.execute(
+                "SELECT name, size, mtime, taken FROM pictures"
+                " WHERE gallery = ?", (relpath, )).fetchall():
+            known[row[0]] = row[1:]
+
+        rows = []
+        for name in directory.model['pictures']:
+            filename = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+
+            previous = known.get(name)
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime):
+                taken = previous[2]
+            else:
+                taken = self._taken(filename)
+
+            rows.append((relpath, name, stat.st_size, stat.st_mtime, taken))
+
+        self.connection.execute(
+            "DELETE FROM pictures WHERE gallery = ?", (relpath, ))
+        self.connection.executemany(
+            "INSERT INTO pictures VALUES (?, ?, ?, ?, ?)", rows)
+        if mtime is None:
+            self.connection.execute(
+                "DELETE FROM galleries WHERE path = ?", (relpath, ))
+        else:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO galleries VALUES (?, ?)",
+                (relpath, mtime))
+        self.connection.commit()
+
+        return True
+
+    def window(self, directory, offset=0, limit=None, after=None):
+        """Return a list of the names of a page of pictures, by date.
+
+        directory is a webnote.directory.Directory, verified first.
+        after, a cursor, gives the pictures after it in the order.
+        Then offset pictures are skipped, and at most limit are given.
+
+        A bare name for a cursor can only be placed while its picture
+        is in the gallery. If it isn't, CursorNotFound is raised,
+        rather than a wrong page given.
+
+        """
+
+        self.update(directory)
+
+        relpath = self._relative(directory.dirpath)
+        query = "SELECT name FROM pictures WHERE gallery = ?"
+        parameters = [relpath]
+
+        if after is not None:
+            if '/' in after:
+                (taken, sep, name) = after.rpartition('/')
+                taken = taken or None
+            else:
+                name = after
+                row = self.connection.execute(
+                    "SELECT taken FROM pictures"
+                    " WHERE gallery = ? AND name = ?",
+                    (relpath, name)).fetchone()
+                if not row:
+                    raise self.CursorNotFound(after)
+                taken = row[0]
+
+            if taken is None:
+                query += " AND taken IS NULL AND name > ?"
+                parameters += [name]
+            else:
+                query += (" AND (taken IS NULL OR taken > ?"
+                          " OR (taken = ? AND name > ?))")
+                parameters += [taken, taken, name]
+
+        query += " ORDER BY taken IS NULL, taken, name LIMIT ? OFFSET ?"
+        if limit is None:
+            limit = -1
+        parameters += [limit, offset]
+
+        return [name for (name, ) in
+                self.connection.execute(query, parameters)]
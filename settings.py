@@ -37,6 +37,90 @@ THUMBNAILS = (
 
 STATIC_URL = '/static'
 
+#   Webnote keeps its own indexes in a hidden directory at the top of
+#   the docroot. Being hidden, it never shows up in a page listing.
+STATE_DIR = '.webnote'
+
+METADATA_INDEX = 'metadata.sqlite'
+
+#   Keep parsed metafiles in hidden sidecar files next to the
+#   metafiles, so unchanged metafiles are not parsed again. This
+#   writes into the archive, so it is off unless asked for.
+METADATA_SIDECAR = False
+
+#   The number of worker processes used to render the children of a
+#   page together, as in Page.render_children(). None means one for
+#   each CPU.
+RENDER_WORKERS = None
+
+#   Time the phases of building and rendering pages. See webnote.timing.
+TIMING = False
+
+#   The number of threads webnote.asyncarchive uses for filesystem work.
+ASYNC_IO_WORKERS = 8
+
+#   The number of threads Directory.walk() lists directories with. One
+#   lists them in turn, which is quickest on a local disk. For an
+#   archive on a network filesystem, where each listing waits on the
+#   server, 8 or 16 is much faster.
+WALK_WORKERS = 1
+
+#   The largest file Page.save() will accept as an upload, in bytes.
+UPLOAD_MAX_SIZE = 256 * 1024 * 1024
+
+#   Subdirectories of the STATE_DIR holding summaries of the EXIF data
+#   of pictures and the contents of GPX files. Both are keyed by the
+#   content hash of the file.
+EXIF_INDEX = 'exif'
+GPX_INDEX = 'gpx'
+
+#   Identical pictures share their thumbnail copies, which are kept in
+#   the STATE_DIR under the hash of the picture. See webnote.hashstore.
+HASH_INDEX = 'hashes.sqlite'
+HASH_OBJECTS = 'objects'
+
+#   Slow maintenance, making derivatives, correlating GPS tracks and
+#   rebuilding indexes, can be put on a queue in the STATE_DIR and done
+#   by worker processes. See webnote.jobs. Only turn BACKGROUND_JOBS on
+#   where a worker is running, started with `cli.py worker <docroot>`:
+#   without one, queued jobs wait for ever, and thumbnails and the
+#   index are never made. With it off, as it is by default, derivatives
+#   of uploads are made by a thread in the serving process, and nothing
+#   is queued.
+BACKGROUND_JOBS = False
+JOB_QUEUE = 'jobs.sqlite'
+
+#   The number of worker processes, None for one for each CPU; seconds
+#   between looks at an empty queue; attempts at a job before it is
+#   marked failed; seconds before the first retry, doubling after; and
+#   seconds a running job may go without reporting before it is taken
+#   to be abandoned, and run again.
+JOB_WORKERS = None
+JOB_POLL = 2
+JOB_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+JOB_TIMEOUT = 60 * 60
+
+#   webnote.watcher gathers a burst of changes for WATCH_DELAY seconds
+#   before acting on them. Where it has to poll, it looks every
+#   WATCH_POLL seconds.
+WATCH_DELAY = 0.5
+WATCH_POLL = 10
+
+#   A manifest of every file in the archive, kept in the STATE_DIR, so
+#   a new process can start without walking the whole archive. See
+#   webnote.manifest. MANIFEST_HASHES records the content hash of each
+#   file as well. MANIFEST_MMAP is the number of bytes of the manifest
+#   read through a memory map.
+MANIFEST = 'manifest.sqlite'
+MANIFEST_HASHES = True
+MANIFEST_MMAP = 256 * 1024 * 1024
+
+#   The EXIF dates of the pictures of each gallery, kept in the
+#   STATE_DIR, so a gallery can be shown a page at a time in the order
+#   its pictures were taken. See webnote.pictureorder.
+PICTURE_ORDER = 'pictures.sqlite'
+
 INDEX_depreciated = {
     'filename': 'filename',
     'caption': 'caption',
@@ -0,0 +1,121 @@
+"""webnote.summary. Lightweight page records for lists of links.
+
+"""
+
+import os
+
+from metadata import Metadata
+import settings
+
+
+class PageSummary(object):
+    """Summarise a page, for lists of children and siblings.
+
+    Building a full webnote.page.Page for every entry in a list lists
+    two directories, reads the file and its metafile, and builds the
+    whole chain of parent pages. Templates listing children and
+    siblings usually only want a title, a link, a date and a
+    thumbnail. A PageSummary computes these from the listing of the
+    directory the page is in, and its metadata. The page file itself
+    is only read if filecontent() is called.
+
+    ### Usage
+
+        PageSummary(directory, fname, address, baseurl)
+
+    The directory is the webnote.Directory object listing the page
+    file fname. It is shared between all the summaries made from it.
+
+    """
+
+    __slots__ = (
+        'address',
+        'baseurl',
+        'directory',
+        'filename',
+        'metadata',
+        'staticroot',
+        '_filecontent',
+        '_thumbnail',
+    )
+
+    def __init__(self, directory, fname, address, baseurl, staticroot=None):
+
+        if not staticroot:
+            staticroot = settings.STATIC_URL
+
+        self.address = address
+        self.baseurl = baseurl
+        self.directory = directory
+        self.filename = os.path.join(directory.dirpath, fname)
+        self.staticroot = staticroot
+
+        self.metadata = Metadata(self.filename, directory=directory)
+
+        self._filecontent = None
+        self._thumbnail = None
+
+    def __unicode__(self):
+        return self.address
+
+    def get_absolute_url(self):
+        return os.path.join(self.baseurl, self.address)
+
+    url = property(get_absolute_url)
+
+    def _get_link(self):
+        (basename, ext) = os.path.splitext(os.path.basename(self.filename))
+        return (self.url, basename)
+
+    link = property(_get_link)
+
+    def filecontent(self):
+        """Return the contents of the page file, read on first call."""
+
+        if self._filecontent is None:
+            try:
+                with open(self.filename, 'r') as f:
+                    self._filecontent = f.read()
+            except IOError:
+                self._filecontent = ''
+
+        return self._filecontent
+
+    def pubdate(self):
+        return self.metadata.pubdate()
+
+    def thumbnail(self):
+        """Return a (src, alt) tuple for the page's thumbnail file.
+
+        The thumbnail lives in the paired directory, which is only
+        listed if the parent directory shows that it exists.
+
+        """
+
+        if self._thumbnail is not None:
+            return self._thumbnail
+
+        self._thumbnail = False
+        (basename, ext) = os.path.splitext(os.path.basename(self.filename))
+
+        if basename in self.directory.model['dirs']:
+            paired = os.path.join(self.directory.dirpath, basename)
+            for item in sorted(os.listdir(paired)):
+                (name, ext) = os.path.splitext(item)
+                if (name.lower() == 'thumbnail' and
+                        ext.lower() in settings.SUFFIX['figures']):
+                    src = os.path.join(
+                        self.staticroot + self.baseurl, self.address, item)
+                    self._thumbnail = (src, item)
+                    break
+
+        return self._thumbnail
+
+    def title(self):
+        """Return the title from the metadata, or the filename made nice."""
+
+        if self.metadata.title():
+            return self.metadata.title()
+
+        (basename, ext) = os.path.splitext(os.path.basename(self.filename))
+        return basename.replace('_', ' ')
@@ -0,0 +1,239 @@
+"""webnote.timing. Opt-in timing of the phases of building a page.
+
+When a page is slow, this says where the time went: the directory
+listings, the metafile, the chain of parent pages, markdown, figure
+references, the BeautifulSoup pass or smartypants.
+
+Timing is off unless settings.TIMING is set, or enable() is called.
+While it is off, each phase costs a flag test.
+
+### Usage
+
+    timing.enable()
+    timing.add_sink(timing.LoggingSink())
+
+    page = Page(docroot, baseurl, address)
+    page.content()
+    page.timings.as_dict()
+        # {'page.init': {'count': 1, 'seconds': 0.0021}, ...}
+
+Each timed phase is sent, as it finishes, to every sink: a callable
+taking a record dictionary with the keys phase, seconds, subject (the
+address, directory or filename concerned, or None) and start (a
+time.time() value). LoggingSink and JSONLinesSink are provided, and
+any other callable will do.
+
+Phases nest, and their times are inclusive. The page.parent phase,
+building the chain of parent pages, includes the directory and
+metadata phases of those pages. Page.timings counts every phase run
+while that page was being built or rendered, its parents' included.
+
+"""
+
+import json
+import logging
+import threading
+import time
+
+import settings
+
+
+_enabled = settings.TIMING
+
+#   Callables given each record. Hold the lock to change the list.
+_sinks = []
+_sinks_lock = threading.Lock()
+
+#   Timings objects collecting the phases run in this thread, innermost
+#   last.
+_local = threading.local()
+
+
+class Timings():
+    """Wall time and call counts, by phase.
+
+    Iterating gives (phase, count, seconds) tuples, sorted by phase.
+
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    def __iter__(self):
+        for phase in sorted(self.phases):
+            (count, seconds) = self.phases[phase]
+            yield (phase, count, seconds)
+
+    def __repr__(self):
+        return '<Timings %s>' % ', '.join(
+            '%s %d %.6f' % item for item in self)
+
+    def add(self, phase, seconds):
+        (count, total) = self.phases.get(phase, (0, 0.0))
+        self.phases[phase] = (count + 1, total + seconds)
+
+    def as_dict(self):
+        """Return {phase: {'count': n, 'seconds': s}}, as for JSON."""
+
+        return dict(
+            (phase, {'count': count, 'seconds': seconds})
+            for (phase, count, seconds) in self)
+
+
+class LoggingSink():
+    """Send each record to a logger, by default webnote.timing's."""
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+
+        if logger is None:
+            logger = logging.getLogger(__name__)
+
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level, '%s %.6f %s', record['phase'],
+                        record['seconds'], record['subject'] or '')
+
+
+class JSONLinesSink():
+    """Append each record to a file, as a line of JSON.
+
+    The file is opened once, and written by one thread at a time.
+
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.f = open(filename, 'a')
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class _Phase():
+    """Time the block it guards, as phase() describes."""
+
+    def __init__(self, name, subject):
+        self.name = name
+        self.subject = subject
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, kind, value, traceback):
+
+        seconds = time.time() - self.start
+
+        for timings in getattr(_local, 'collectors', ()):
+            timings.add(self.name, seconds)
+
+        if _sinks:
+            record = {
+                'phase': self.name,
+                'seconds': seconds,
+                'subject': self.subject,
+                'start': self.start,
+            }
+            with _sinks_lock:
+                sinks = list(_sinks)
+            for sink in sinks:
+                sink(record)
+
+        return False
+
+
+class _Collect():
+    """Add phases run in this thread to a Timings, as collect() says."""
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __enter__(self):
+
+        if not hasattr(_local, 'collectors'):
+            _local.collectors = []
+        _local.collectors.append(self.timings)
+
+    def __exit__(self, kind, value, traceback):
+        _local.collectors.pop()
+        return False
+
+
+class _Nothing():
+    """Stand in for _Phase and _Collect while timing is off."""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+
+_nothing = _Nothing()
+
+
+def add_sink(sink):
+    """Register a callable to be given a record for every phase timed."""
+
+    with _sinks_lock:
+        if sink not in _sinks:
+            _sinks.append(sink)
+
+
+def collect(timings):
+    """Return a context manager adding the phases run within to timings.
+
+    Collections nest. A phase is added to every Timings being
+    collected in the thread when it finishes.
+
+    """
+
+    if not _enabled or timings is None:
+        return _nothing
+
+    return _Collect(timings)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+def phase(name, subject=None):
+    """Return a context manager timing the block it guards as name.
+
+    The time is added to the Timings being collected, and sent to the
+    sinks, with the subject, if timing is on.
+
+    """
+
+    if not _enabled:
+        return _nothing
+
+    return _Phase(name, subject)
+
+
+def remove_sink(sink):
+
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
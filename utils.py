@@ -1,8 +1,122 @@
 """General utilities.
 
     Padding a number with leading zeros.
+
+    Writing files atomically, with optional advisory locking. Large
+    files can be streamed in, and hashed on the way.
+
+    Invalidation hooks, called when a file in the archive changes.
 """
 
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+
+
+#   The process umask, read once by _get_umask() so that new files
+#   written through a temporary file get the usual permissions.
+_umask = None
+
+#   Callables taking a pathname, called by invalidate(). Hold the lock
+#   to change the list.
+_invalidation_hooks = []
+_invalidation_lock = threading.Lock()
+
+
+class FileTooLarge(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def add_invalidation_hook(hook):
+    """Register a callable to be told when a file in the archive changes.
+
+    The hook is called with the pathname of a file or directory which
+    has been written, created or removed. Anything keeping a cache of
+    what it read from the archive should register one, and drop its
+    entries for that path.
+
+    """
+
+    with _invalidation_lock:
+        if hook not in _invalidation_hooks:
+            _invalidation_hooks.append(hook)
+
+
+def atomic_write(filename, data, mode='w', lock=False):
+    """Replace the contents of filename with data, all at once.
+
+    The data is written to a hidden temporary file in the same
+    directory, flushed and synced to disk, then renamed over the
+    target. A reader sees either the old file or the new one, never a
+    part-written one, even if the process dies half way.
+
+    With lock set, an advisory lock is held while writing, so
+    concurrent editors using this function take turns.
+
+    """
+
+    atomic_stream([data], filename, mode, lock=lock)
+
+
+def atomic_stream(chunks, filename, mode='wb', max_size=None, lock=False):
+    """Write an iterable of chunks to filename, as atomic_write() does.
+
+    This is for uploads. Only one chunk is held in memory at a time.
+    The data is hashed as it is written, and the function returns a
+    (sha256 hexdigest, size) tuple. The digest identifies the content,
+    so identical files can be found without reading them again.
+
+    If max_size is given, and the data runs past it, the temporary
+    file is removed, the target is left untouched, and FileTooLarge is
+    raised.
+
+    """
+
+    (path, fname) = os.path.split(filename)
+
+    if lock:
+        with file_lock(filename):
+            return _write_and_replace(path, fname, chunks, mode, max_size)
+
+    return _write_and_replace(path, fname, chunks, mode, max_size)
+
+
+@contextmanager
+def file_lock(filename):
+    """Hold an exclusive advisory lock on filename.
+
+    The lock is taken on a hidden lock file beside the target, so the
+    target itself can be replaced while the lock is held.
+
+    """
+
+    (path, fname) = os.path.split(filename)
+    lockname = os.path.join(path, '.' + fname + '.lock')
+
+    with open(lockname, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def invalidate(path):
+    """Tell every registered hook that path has changed."""
+
+    with _invalidation_lock:
+        hooks = list(_invalidation_hooks)
+
+    for hook in hooks:
+        hook(path)
+
 
 def pad(input, length):
     """Pad a number with leading zeros.
@@ -20,3 +134,93 @@ def pad(input, length):
     a += str(input)
 
     return a
+
+
+def remove_invalidation_hook(hook):
+
+    with _invalidation_lock:
+        if hook in _invalidation_hooks:
+            _invalidation_hooks.remove(hook)
+
+
+def _get_umask(path):
+    """Return the process umask, without changing it.
+
+    os.umask() can only read the umask by setting it, and a file made
+    by another thread meanwhile would get the wrong permissions. Linux
+    reports it in /proc/self/status. Elsewhere a file is made in the
+    directory path, asking for every permission, to see which the
+    umask takes away.
+
+    """
+
+    global _umask
+
+    if _umask is not None:
+        return _umask
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    _umask = int(line.split()[1], 8)
+                    return _umask
+    except (IOError, ValueError):
+        pass
+
+    probe = os.path.join(path, '.umask.%d.%d~' % (
+        os.getpid(), threading.current_thread().ident))
+
+    fd = os.open(probe, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o777)
+    try:
+        _umask = 0o777 & ~os.fstat(fd).st_mode
+    finally:
+        os.close(fd)
+        os.unlink(probe)
+
+    return _umask
+
+
+def _write_and_replace(path, fname, chunks, mode, max_size=None):
+
+    filename = os.path.join(path, fname)
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        permissions = os.stat(filename).st_mode & 0o777
+    except OSError:
+        permissions = 0o666 & ~_get_umask(path or '.')
+
+    (fd, tempname) = tempfile.mkstemp(
+        prefix='.' + fname + '.', suffix='~', dir=path or '.')
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise FileTooLarge(filename)
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tempname, permissions)
+        os.rename(tempname, filename)
+    except:
+        os.remove(tempname)
+        raise
+
+    _sync_directory(path)
+
+    return (digest.hexdigest(), size)
+
+
+def _sync_directory(path):
+    """Flush a directory entry to disk, so a rename survives a crash."""
+
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
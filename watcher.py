@@ -0,0 +1,391 @@
+"""webnote.watcher. Keep the indexes up to date as the archive changes.
+
+A Watcher follows changes to the files in an archive, and does just
+the work each change calls for:
+
+    -   Invalidation hooks (webnote.utils.invalidate) are called for
+        every file changed, so Directory listings, metadata sidecars
+        and any other registered cache drop what they held for it.
+    -   A page, or a metafile describing one, is indexed again in the
+        webnote.metaindex.MetadataIndex. A page removed is dropped.
+    -   A picture or GPX file has its derivatives queued, as uploads
+        do. See webnote.derivatives.
+
+Editing one page costs one page's worth of work. The whole index is
+only refreshed when changes were missed, or a directory was removed.
+
+On Linux, changes are followed with inotify. Elsewhere, or if inotify
+can't be used, the archive is polled. Run it with:
+
+    python cli.py watch <docroot>
+
+Caches are held per process, so the Watcher invalidates those of the
+process it runs in. A server wanting its own caches told of changes
+made outside it runs a Watcher in a thread.
+
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+import derivatives
+from metaindex import MetadataIndex
+import settings
+import utils
+
+
+logger = logging.getLogger(__name__)
+
+#   From <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+EVENT = struct.Struct('iIII')
+
+#   Directories of thumbnail copies, which the watcher leaves alone.
+DERIVED = (settings.FILEMAP_PICTURES['1024px'] +
+           settings.FILEMAP_PICTURES['512px'])
+
+
+class Watcher():
+    """Follow changes to an archive, and keep its indexes current.
+
+    ### Usage
+
+        watcher = Watcher(docroot)
+        watcher.run()
+
+    Set poll to use polling even where inotify is available. run()
+    goes on until stop() is called, from a signal handler or another
+    thread.
+
+    """
+
+    docroot = None
+    index = None
+    backend = None
+
+    def __init__(self, docroot, poll=False):
+
+        if docroot[-1] == '/':
+            docroot = docroot[:-1]
+
+        self.docroot = docroot
+        self._running = False
+
+        if not poll:
+            try:
+                self.backend = InotifyWatch(docroot)
+            except OSError as e:
+                logger.warning('inotify unavailable, polling: %s', e)
+
+        if self.backend is None:
+            self.backend = PollingWatch(docroot)
+
+    def _described_by(self, metafile):
+        """Return the page files a metafile may describe.
+
+        A metafile named like the page is found beside it, in the
+        meta directory beside it, or in its paired directory.
+
+        """
+
+        (path, fname) = os.path.split(metafile)
+        (basename, ext) = os.path.splitext(fname)
+
+        paths = [path]
+        (parent, last) = os.path.split(path)
+        if last + '/' in settings.META or last == basename:
+            paths.append(parent)
+
+        pagefiles = []
+        for path in paths:
+            for suffix in settings.SUFFIX['page']:
+                pagefile = os.path.join(path, basename + suffix)
+                if os.path.isfile(pagefile):
+                    pagefiles.append(pagefile)
+
+        return pagefiles
+
+    def close(self):
+        self.backend.close()
+        if self.index is not None:
+            self.index.close()
+
+    def handle(self, paths, rescan=False):
+        """Bring the indexes up to date with changes at paths.
+
+        If rescan is set, changes may have been missed, and the whole
+        metadata index is refreshed. Return a tuple of the number of
+        pages indexed and the number of files queued for derivatives.
+
+        """
+
+        # Opened here, in the thread which runs the watcher, as sqlite
+        # connections can't be shared between threads.
+        if self.index is None:
+            self.index = MetadataIndex(self.docroot)
+
+        pages = set()
+        queued = 0
+
+        for path in sorted(paths):
+            utils.invalidate(path)
+
+            (basename, ext) = os.path.splitext(path)
+            ext = ext.lower()
+
+            if ext in settings.SUFFIX['page']:
+                pages.add(path)
+            elif ext == '.meta':
+                pages.update(self._described_by(path))
+            elif derivatives.has_derivatives(path) and os.path.isfile(path):
+                if derivatives.enqueue(path, self.docroot):
+                    queued += 1
+
+        if rescan:
+            return (self.index.refresh(), queued)
+
+        for pagefile in pages:
+            if os.path.isfile(pagefile):
+                self.index.update(pagefile)
+            else:
+                self.index.discard(pagefile)
+
+        return (len(pages), queued)
+
+    def run(self):
+        """Follow changes until stop() is called."""
+
+        self._running = True
+        try:
+            while self._running:
+                (paths, rescan) = self.backend.events(timeout=1)
+                if paths or rescan:
+                    (pages, queued) = self.handle(paths, rescan)
+                    logger.info('%d changes: %d pages indexed, %d queued',
+                                len(paths), pages, queued)
+        finally:
+            if self.index is not None:
+                self.index.close()
+                self.index = None
+
+    def stop(self):
+        self._running = False
+
+
+class InotifyWatch():
+    """Changes to an archive, from Linux inotify.
+
+    A watch is put on every directory in the archive, other than
+    hidden and thumbnail directories, and on new directories as they
+    appear.
+
+    """
+
+    MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_CREATE | IN_DELETE |
+            IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR)
+
+    docroot = None
+    fd = None
+
+    def __init__(self, docroot):
+
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'No inotify in this C library')
+
+        self.fd = _libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+
+        self.docroot = docroot
+        # Watched directories, keyed by watch descriptor.
+        self.paths = {}
+        self._add_tree(docroot)
+
+    def _add_tree(self, top):
+        """Watch top and the directories below. Return the files found."""
+
+        filenames = []
+        for (dirpath, dirnames, fnames) in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not _skip(d)]
+
+            wd = _libc.inotify_add_watch(self.fd, dirpath, self.MASK)
+            if wd < 0:
+                raise OSError(
+                    ctypes.get_errno(), 'inotify_add_watch', dirpath)
+            self.paths[wd] = dirpath
+
+            filenames += [os.path.join(dirpath, f)
+                          for f in fnames if not _skip(f)]
+
+        return filenames
+
+    def _forget_tree(self, top):
+        """Stop watching a directory moved out of the way, and below."""
+
+        for (wd, path) in list(self.paths.items()):
+            if path == top or path.startswith(top + '/'):
+                _libc.inotify_rm_watch(self.fd, wd)
+                del self.paths[wd]
+
+    def close(self):
+        os.close(self.fd)
+
+    def events(self, timeout=None):
+        """Wait up to timeout seconds for changes.
+
+        Return a tuple of the set of paths changed, and True if the
+        whole archive should be looked at again. A burst of changes,
+        like an editor saving, is gathered up for settings.WATCH_DELAY
+        seconds and returned together.
+
+        """
+
+        paths = set()
+        rescan = False
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return (paths, rescan)
+
+        time.sleep(settings.WATCH_DELAY)
+
+        while select.select([self.fd], [], [], 0)[0]:
+            data = os.read(self.fd, 65536)
+            offset = 0
+
+            while offset < len(data):
+                (wd, mask, cookie, length) = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    continue
+
+                dirpath = self.paths.get(wd)
+                if dirpath is None or _skip(name):
+                    continue
+                path = os.path.join(dirpath, name)
+
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        paths.update(self._add_tree(path))
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._forget_tree(path)
+                        rescan = True
+                    continue
+
+                paths.add(path)
+
+        return (paths, rescan)
+
+
+class PollingWatch():
+    """Changes to an archive, found by comparing stats between walks.
+
+    Each look costs a stat of every file, so the interval between
+    looks, settings.WATCH_POLL, should be generous on a big archive.
+
+    """
+
+    docroot = None
+    interval = None
+
+    def __init__(self, docroot, interval=None):
+
+        if not interval:
+            interval = settings.WATCH_POLL
+
+        self.docroot = docroot
+        self.interval = interval
+        self._waited = 0
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        """Return {filename: (mtime, size)} for the archive."""
+
+        snapshot = {}
+        for (dirpath, dirnames, fnames) in os.walk(self.docroot):
+            dirnames[:] = [d for d in dirnames if not _skip(d)]
+            for fname in fnames:
+                if _skip(fname):
+                    continue
+                filename = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                snapshot[filename] = (stat.st_mtime, stat.st_size)
+
+        return snapshot
+
+    def close(self):
+        pass
+
+    def events(self, timeout=None):
+        """Return the paths changed since the last look, as for inotify.
+
+        The archive is walked once every interval seconds. Calls in
+        between wait up to timeout seconds, and return nothing.
+
+        """
+
+        wait = self.interval - self._waited
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            self._waited += timeout
+            return (set(), False)
+
+        time.sleep(wait)
+        self._waited = 0
+
+        snapshot = self._scan()
+        paths = set(
+            filename for (filename, stat) in snapshot.items()
+            if self._snapshot.get(filename) != stat)
+        paths.update(set(self._snapshot) - set(snapshot))
+        self._snapshot = snapshot
+
+        return (paths, False)
+
+
+def _skip(name):
+    """True for hidden, temporary and thumbnail files and directories."""
+
+    return name[0] == '.' or name[-1] == '~' or name in DERIVED
+
+
+def _load_libc():
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+_libc = _load_libc()
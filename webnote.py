@@ -10,7 +10,6 @@ import csv
 import os
 import settings
 import re
-import cgi
 
 
 class Webnote():
@@ -21,9 +20,12 @@ class Webnote():
 
     Return (processed text, list of unreferenced figures).
 
+    Subclasses keep their warnings in a list on the instance, so that
+    objects built for different requests never share them.
+
     """
 
-    warnings = []
+    warnings = None
 
     def reference_figures(self, source, baseurl, figures):
         """Convert coded references to figures in a text into HTML.
@@ -134,6 +136,8 @@ class Webnote():
 
         caption = ' '.join(words)
         caption = caption.strip()
+        # Imported here, as only figure references need it.
+        import cgi
         caption = cgi.escape(caption)
 
         link = (filename, caption)